@@ -0,0 +1,105 @@
+"""Benchmark das listas de exames: colunas grandes carregadas (antes) x adiadas (depois).
+
+Uso (na raiz do projeto):
+    python benchmarks/exam_list_queries.py --exams 2000 --text-kb 50 --per-page 10 50
+
+Cria um banco SQLite temporário com exames de texto extraído grande e mede,
+por página da lista, os bytes lidos do banco e a latência de consulta + serialização.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_folder = tempfile.mkdtemp(prefix='bench-exams-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_folder, "bench.db")}'
+os.environ['JOB_WORKER_MODE'] = 'external'
+os.chdir(_folder)  # uploads/ e previews/ do app ficam no diretório temporário
+
+from sqlalchemy.orm import undefer  # noqa: E402
+from src.main import app  # noqa: E402
+from src.models import db  # noqa: E402
+from src.models.exam import Exam  # noqa: E402
+from src.models.patient import Patient  # noqa: E402
+
+
+def populate(exam_count, text_kb):
+    patient = Patient(full_name='Paciente Benchmark', cpf='529.982.247-25', birth_date=date(1980, 5, 17), gender='F')
+    db.session.add(patient)
+    db.session.flush()
+
+    text = ('Hemoglobina 13,5 g/dL; Leucócitos 7.200/mm3; Plaquetas 250.000/mm3. ' * (text_kb * 16))[:text_kb * 1024]
+    values = json.dumps({'valores': [{'nome': f'Parâmetro {i}', 'valor': '1,0', 'unidade': 'mg/dL'}
+                                     for i in range(40)]})
+    analysis = json.dumps({'valores_alterados': [], 'observacoes': 'Sem alterações relevantes. ' * 50})
+    pages = [text[page * len(text) // 10:(page + 1) * len(text) // 10] for page in range(10)]
+    for index in range(exam_count):
+        exam = Exam(
+            patient_id=patient.id, original_filename=f'exame_{index}.pdf', file_path=f'uploads/x/{index}.pdf',
+            file_size=1024 * 1024, file_type='pdf', mime_type='application/pdf', exam_type='Hemograma',
+            processing_status='completed', extracted_values=values, ai_analysis=analysis,
+            ai_summary='Resumo automático. ' * 100
+        )
+        exam.set_pages(pages)
+        db.session.add(exam)
+    db.session.commit()
+    return patient.id
+
+
+def list_query(patient_id, per_page, eager):
+    query = Exam.query.filter_by(patient_id=patient_id).order_by(Exam.created_at.desc()).limit(per_page)
+    if eager:
+        query = query.options(undefer('*'))  # comportamento anterior: todas as colunas
+    return query
+
+
+def bytes_read(query):
+    """Soma do tamanho dos valores devolvidos pelo banco para a consulta"""
+    total = 0
+    for row in db.session.connection().execute(query.statement):  # linhas cruas, sem ORM
+        for value in row:
+            if isinstance(value, (str, bytes)):
+                total += len(value.encode() if isinstance(value, str) else value)
+            elif value is not None:
+                total += 8
+    return total
+
+
+def measure(patient_id, per_page, eager, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        [exam.to_summary_dict() for exam in list_query(patient_id, per_page, eager).all()]
+        timings.append(time.perf_counter() - start)
+    db.session.expunge_all()
+    return statistics.median(timings), bytes_read(list_query(patient_id, per_page, eager))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--exams', type=int, default=2000)
+    parser.add_argument('--text-kb', type=int, default=50)
+    parser.add_argument('--per-page', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        patient_id = populate(args.exams, args.text_kb)
+        print(f'{args.exams} exames, texto de {args.text_kb}KB por exame')
+        print(f'{"por página":>10} {"antes (KB)":>11} {"depois (KB)":>12} {"antes (ms)":>11} {"depois (ms)":>12}')
+        for per_page in args.per_page:
+            before_time, before_bytes = measure(patient_id, per_page, True, args.repeat)
+            after_time, after_bytes = measure(patient_id, per_page, False, args.repeat)
+            print(f'{per_page:>10} {before_bytes / 1024:>11.1f} {after_bytes / 1024:>12.1f} '
+                  f'{before_time * 1000:>11.2f} {after_time * 1000:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark da extração de texto de PDFs: caminho antigo x extração por páginas em paralelo.
+
+Uso (na raiz do projeto):
+    python benchmarks/pdf_extraction.py --pages 20 80 200 --repeat 3
+
+Os PDFs são sintéticos (texto simples em cada página) e ficam num diretório temporário.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services import pdf_extraction  # noqa: E402
+
+LINES_PER_PAGE = 45
+
+
+def write_synthetic_pdf(path, page_count):
+    """Gera um PDF com ``page_count`` páginas de texto (sem dependências externas)"""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    pages_id = add(None)  # preenchido depois de conhecer as páginas
+    page_ids = []
+    for page in range(page_count):
+        lines = [b'BT /F1 10 Tf 50 800 Td 12 TL']
+        for line in range(LINES_PER_PAGE):
+            lines.append(b'(Pagina %d linha %d: hemoglobina 13.5 g/dL leucocitos 7200 /mm3) \'' % (page + 1, line + 1))
+        lines.append(b'ET')
+        stream = b'\n'.join(lines)
+        content_id = add(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        page_ids.append(add(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (pages_id, font_id, content_id)
+        ))
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    objects[pages_id - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, page_count)
+    catalog_id = add(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref_offset = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        output += b'%010d 00000 n \n' % offset
+    output += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objects) + 1, catalog_id, xref_offset)
+
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def extract_legacy(path):
+    """Caminho anterior: páginas uma a uma com ``text +=``"""
+    import PyPDF2
+    text = ""
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        for page in reader.pages:
+            text += page.extract_text() or ""
+    return text
+
+
+def measure(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 40, 80, 200])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'processos no pool: {pdf_extraction.PDF_EXTRACTION_PROCESSES}, '
+          f'páginas por faixa: {pdf_extraction.PDF_PAGES_PER_CHUNK}')
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Aquece o pool (criação dos processos não entra na medição)
+        warmup = os.path.join(folder, 'warmup.pdf')
+        write_synthetic_pdf(warmup, pdf_extraction.PDF_PAGES_PER_CHUNK * 2)
+        pdf_extraction.extract_pdf_text(warmup, max_pages=0, parallel=True)
+
+        print(f'{"páginas":>8} {"antigo (s)":>11} {"sequencial (s)":>15} {"paralelo (s)":>13} {"ganho":>7}')
+        for page_count in args.pages:
+            path = os.path.join(folder, f'synthetic_{page_count}.pdf')
+            write_synthetic_pdf(path, page_count)
+
+            legacy_time, legacy_text = measure(lambda: extract_legacy(path), args.repeat)
+            sequential_time, sequential_text = measure(
+                lambda: pdf_extraction.extract_pdf_text(path, max_pages=0, parallel=False), args.repeat)
+            parallel_time, parallel_text = measure(
+                lambda: pdf_extraction.extract_pdf_text(path, max_pages=0, parallel=True), args.repeat)
+
+            assert legacy_text == sequential_text == parallel_text, 'texto extraído diverge'
+            print(f'{page_count:>8} {legacy_time:>11.3f} {sequential_time:>15.3f} '
+                  f'{parallel_time:>13.3f} {legacy_time / parallel_time:>6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+# Ferramenta de linha de comando: sem threads de jobs
+os.environ['JOB_WORKER_MODE'] = 'external'
+
+from sqlalchemy import text
+from sqlalchemy.orm import undefer
+from src.main import app
+from src.models import db
+from src.models.compressed_text import compress_text, decompress_text, is_compressed
+from src.models.exam import COMPRESSED_EXAM_COLUMNS, Exam
+from src.models.exam_page import COMPRESSED_PAGE_COLUMNS, ExamPage
+
+# Comprime, em lotes, textos de exames gravados antes de CompressedText.
+# Pode ser interrompido e executado de novo: linhas já comprimidas são puladas.
+#
+#   python src/compress_exam_text.py --batch-size 200 [--dry-run] [--vacuum]
+
+COMPRESSED_COLUMNS = {'exams': COMPRESSED_EXAM_COLUMNS, 'exam_pages': COMPRESSED_PAGE_COLUMNS}
+
+
+def stored_bytes(connection):
+    """Bytes ocupados por coluna comprimível, como 'tabela.coluna' (texto antigo conta em UTF-8)"""
+    if connection.dialect.name == 'sqlite':
+        size = 'LENGTH(CAST({column} AS BLOB))'
+    else:
+        size = 'OCTET_LENGTH({column})'
+    result = {}
+    for table, columns in COMPRESSED_COLUMNS.items():
+        sums = ', '.join(f'COALESCE(SUM({size.format(column=column)}), 0)' for column in columns)
+        row = connection.execute(text(f'SELECT {sums} FROM {table}')).one()
+        result.update({f'{table}.{column}': value for column, value in zip(columns, row)})
+    return result
+
+
+def read_latency(ids, repeat=5):
+    """Mediana (ms) para carregar e descomprimir resultados e páginas dos exames ``ids`` pelo ORM"""
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        exams = Exam.query.filter(Exam.id.in_(ids)).options(
+            *[undefer(getattr(Exam, column)) for column in COMPRESSED_EXAM_COLUMNS]
+        ).all()
+        for exam in exams:
+            for column in COMPRESSED_EXAM_COLUMNS:
+                getattr(exam, column)
+        for page in ExamPage.query.filter(ExamPage.exam_id.in_(ids)).all():
+            page.text
+        timings.append(time.perf_counter() - start)
+    db.session.expunge_all()
+    return statistics.median(timings) * 1000
+
+
+def scan_latency(repeat=5):
+    """Mediana (ms) de uma varredura de exams lendo colunas pequenas (custo de linhas grandes)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        db.session.execute(text('SELECT id, processing_status, created_at FROM exams')).all()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def compress_batch(connection, table, last_id, batch_size, dry_run=False):
+    """Comprime um lote de ``table`` com id > last_id; retorna (último id, valores comprimidos)"""
+    columns = COMPRESSED_COLUMNS[table]
+    rows = connection.execute(text(
+        f'SELECT id, {", ".join(columns)} FROM {table} WHERE id > :last_id ORDER BY id LIMIT :limit'
+    ), {'last_id': last_id, 'limit': batch_size}).all()
+    if not rows:
+        return None, 0
+
+    changed = 0
+    for index, column in enumerate(columns, start=1):
+        updates = []
+        for row in rows:
+            raw = row[index]
+            if raw is None or is_compressed(raw):
+                continue
+            value = compress_text(decompress_text(raw))
+            if is_compressed(value):  # valores pequenos continuam como estão
+                updates.append({'id': row.id, 'value': value})
+        if updates and not dry_run:
+            connection.execute(text(f'UPDATE {table} SET {column} = :value WHERE id = :id'), updates)
+        changed += len(updates)
+
+    return rows[-1].id, changed
+
+
+def database_file():
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        return url.database
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Comprime textos e JSONs de exames gravados sem compressão')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--dry-run', action='store_true', help='só calcula a economia, sem gravar')
+    parser.add_argument('--vacuum', action='store_true', help='SQLite: VACUUM ao final para devolver o espaço')
+    parser.add_argument('--sample', type=int, default=100, help='exames usados na medição de leitura')
+    args = parser.parse_args()
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            before = stored_bytes(connection)
+        sample_ids = [row.id for row in db.session.execute(text(
+            'SELECT id FROM exams WHERE page_count > 0 OR has_results ORDER BY id DESC LIMIT :limit'
+        ), {'limit': args.sample})]
+        read_before, scan_before = read_latency(sample_ids), scan_latency()
+        path = database_file()
+        file_before = os.path.getsize(path) if path else None
+
+        total_changed, started = 0, time.perf_counter()
+        for table in COMPRESSED_COLUMNS:
+            last_id = 0
+            while last_id is not None:
+                with db.engine.begin() as connection:  # uma transação por lote
+                    last_id, changed = compress_batch(connection, table, last_id, args.batch_size, args.dry_run)
+                total_changed += changed
+                if last_id is not None:
+                    print(f'  {table} até o id {last_id}: {total_changed} valores comprimidos')
+        elapsed = time.perf_counter() - started
+
+        if args.dry_run:
+            print(f'Simulação: {total_changed} valores seriam comprimidos (nada foi gravado)')
+            return
+
+        if args.vacuum and path:
+            with db.engine.connect() as connection:
+                connection.execute(text('VACUUM'))
+
+        with db.engine.connect() as connection:
+            after = stored_bytes(connection)
+        read_after, scan_after = read_latency(sample_ids), scan_latency()
+        before['total'], after['total'] = sum(before.values()), sum(after.values())
+
+        print(f'\n{total_changed} valores comprimidos em {elapsed:.1f}s')
+        print(f'{"coluna":<28} {"antes (KB)":>11} {"depois (KB)":>12} {"economia":>9}')
+        for column in before:
+            saved = 1 - after[column] / before[column] if before[column] else 0
+            print(f'{column:<28} {before[column] / 1024:>11.1f} {after[column] / 1024:>12.1f} {saved:>9.0%}')
+        print(f'Leitura de {len(sample_ids)} exames (ms): {read_before:.1f} -> {read_after:.1f}')
+        print(f'Varredura de exams (ms): {scan_before:.1f} -> {scan_after:.1f}')
+        if path:
+            note = '' if args.vacuum else ' (use --vacuum para devolver o espaço livre)'
+            print(f'Arquivo do banco: {file_before / 1024 / 1024:.1f}MB -> '
+                  f'{os.path.getsize(path) / 1024 / 1024:.1f}MB{note}')
+
+
+if __name__ == '__main__':
+    main()
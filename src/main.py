@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 # DON'T CHANGE THIS !!!
@@ -37,6 +38,10 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Limite do corpo das requisições: uploads acima disso são recusados (413)
+# antes de serem lidos. Rotas de lote podem ampliar por requisição.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 25 * 1024 * 1024))
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,
     'pool_recycle': 300
@@ -49,7 +54,12 @@ db.init_app(app)
 from src.models.config_simple import Config
 from src.models.patient import Patient
 from src.models.exam import Exam
+from src.models.exam_page import ExamPage
+from src.models.exam_counters import ExamStatusCounter, StorageUsage
 from src.models.user import User
+from src.models.job import Job
+from src.models.file_blob import FileBlob
+from src.models.migrations import run_migrations
 
 # Agora podemos importar e registrar os blueprints
 from src.routes.user import user_bp
@@ -64,8 +74,21 @@ app.register_blueprint(patient_bp, url_prefix='/api')
 app.register_blueprint(exam_bp, url_prefix='/api')
 app.register_blueprint(reports_bp, url_prefix='/api')
 
-with app.app_context():
-    db.create_all()
+# Processos auxiliares (pools de extração de PDF e OCR, iniciados com 'spawn')
+# reimportam este módulo quando ele é o script principal: neles não há
+# migrações nem workers de jobs.
+is_helper_process = multiprocessing.parent_process() is not None
+
+if not is_helper_process:
+    with app.app_context():
+        db.create_all()
+        run_migrations()
+
+# Workers da fila de jobs (processamento de exames). Com JOB_WORKER_MODE=external
+# os jobs são consumidos por um processo separado (python src/worker.py).
+if os.environ.get('JOB_WORKER_MODE', 'inprocess') == 'inprocess' and not is_helper_process:
+    from src.services.job_queue import start_workers
+    start_workers(app, int(os.environ.get('JOB_WORKER_THREADS', 2)))
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -83,6 +106,13 @@ def serve(path):
         else:
             return "index.html not found", 404
 
+@app.errorhandler(413)
+def request_too_large(error):
+    return {
+        'success': False,
+        'error': 'Arquivo muito grande'
+    }, 413
+
 @app.route('/health')
 def health_check():
     return {'status': 'healthy', 'service': 'sistema-prontuario-backend'}
@@ -0,0 +1,55 @@
+import os
+import zlib
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+# Textos grandes dos exames (texto extraído, JSONs da IA) comprimidos com zlib
+TEXT_COMPRESSION_LEVEL = int(os.environ.get('TEXT_COMPRESSION_LEVEL', 6))
+TEXT_COMPRESSION_MIN_BYTES = int(os.environ.get('TEXT_COMPRESSION_MIN_BYTES', 256))  # abaixo disso fica sem comprimir
+
+# Prefixo dos valores comprimidos. Texto nunca começa com NUL (o PostgreSQL nem
+# aceita NUL em TEXT), então valores sem ele são texto UTF-8 puro.
+MAGIC = b'\x00zl'
+
+
+def compress_text(value):
+    """Bytes gravados no banco para ``value``: MAGIC + zlib, ou UTF-8 puro se comprimir não compensa"""
+    data = value.encode('utf-8')
+    if len(data) >= TEXT_COMPRESSION_MIN_BYTES:
+        compressed = MAGIC + zlib.compress(data, TEXT_COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            return compressed
+    return data
+
+
+def decompress_text(raw):
+    """Texto de um valor lido do banco: comprimido, UTF-8 puro ou texto de coluna ainda não convertida"""
+    if isinstance(raw, str):
+        return raw  # linha antiga em coluna TEXT (SQLite guarda os dois tipos na mesma coluna)
+    raw = bytes(raw)  # psycopg2 devolve memoryview para BYTEA
+    if raw.startswith(MAGIC):
+        return zlib.decompress(raw[len(MAGIC):]).decode('utf-8')
+    return raw.decode('utf-8')
+
+
+def is_compressed(raw):
+    return raw is not None and not isinstance(raw, str) and bytes(raw[:len(MAGIC)]) == MAGIC
+
+
+class CompressedText(TypeDecorator):
+    """Texto guardado comprimido numa coluna binária (BLOB/BYTEA), transparente para o ORM.
+
+    Lê também valores antigos sem compressão, então a conversão das linhas
+    existentes (python src/compress_exam_text.py) pode rodar aos poucos.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
@@ -1,9 +1,15 @@
+from .compressed_text import CompressedText
 from .db import db
+from .fieldsets import SparseFieldsMixin
 from datetime import datetime
+from sqlalchemy import event, inspect
 import json
 import os
 
-class Exam(db.Model):
+TEXT_PREVIEW_LENGTH = 300  # caracteres do texto extraído no payload do exame
+COMPRESSED_EXAM_COLUMNS = ('ai_analysis', 'extracted_values')  # tipo CompressedText
+
+class Exam(SparseFieldsMixin, db.Model):
     __tablename__ = 'exams'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -15,6 +21,7 @@ class Exam(db.Model):
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer)  # em bytes
+    file_hash = db.Column(db.String(64), index=True)  # SHA-256 do conteúdo (hex)
     file_type = db.Column(db.String(50))  # 'image' ou 'pdf'
     mime_type = db.Column(db.String(100))
     
@@ -24,21 +31,40 @@ class Exam(db.Model):
     lab_name = db.Column(db.String(200))  # Nome do laboratório
     doctor_name = db.Column(db.String(200))  # Médico solicitante
     
-    # Dados extraídos pela IA
-    extracted_text = db.Column(db.Text)          # Texto extraído do arquivo
-    ai_analysis = db.Column(db.Text)             # JSON (armazenado como string)
-    extracted_values = db.Column(db.Text)        # JSON (armazenado como string)
-    ai_summary = db.Column(db.Text)              # Resumo gerado pela IA
+    # Dados extraídos pela IA. As colunas de texto grande são adiadas (deferred):
+    # listas não as leem; quem precisa usa load_options/undefer na consulta.
+    # As maiores ficam comprimidas (CompressedText) e só são descomprimidas ao carregar.
+    # O texto extraído fica só em exam_pages (ver extracted_text).
+    page_count = db.Column(db.Integer)                     # Páginas com texto em exam_pages
+    text_preview = db.Column(db.String(500))               # Início do texto, para listagens/visualização
+    ai_analysis = db.deferred(db.Column(CompressedText), group='results')       # JSON (armazenado como string)
+    extracted_values = db.deferred(db.Column(CompressedText), group='results')  # JSON (armazenado como string)
+    ai_summary = db.deferred(db.Column(db.Text), group='results')        # Resumo gerado pela IA
+    has_results = db.Column(db.Boolean, nullable=False, default=False)   # extracted_values ou ai_summary preenchidos
     
     # Status do processamento
-    processing_status = db.Column(db.String(50), default='pending')  # pending, processing, completed, error
+    # pending, processing, completed, error (active_history: o valor anterior alimenta exam_status_counters)
+    processing_status = db.column_property(db.Column(db.String(50), default='pending'), active_history=True)
     processing_error = db.Column(db.Text)  # Erro de processamento, se houver
     
+    # Presença do arquivo em disco (mantida no upload e pelo job reconcile_exam_files;
+    # a serialização não consulta o disco)
+    file_available = db.Column(db.Boolean, nullable=False, default=True)
+    
     # Metadados
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     processed_at = db.Column(db.DateTime)  # Quando foi processado
 
+    # Texto por página (carregado só quando usado; ver ExamPage.get_range)
+    pages = db.relationship('ExamPage', lazy='select', order_by='ExamPage.page_no',
+                            cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # Versão agregada dos relatórios do paciente (MAX(updated_at), COUNT)
+        db.Index('ix_exams_patient_id_updated_at', 'patient_id', 'updated_at'),
+    )
+
     def __init__(self, **kwargs):
         # Converte dicionários/listas para JSON strings nos campos esperados
         for field in ['ai_analysis', 'extracted_values']:
@@ -80,6 +106,26 @@ class Exam(db.Model):
         """Define valores extraídos (aceita dict ou None)"""
         self.extracted_values = json.dumps(values_dict) if values_dict else None
 
+    @property
+    def extracted_text(self):
+        """Texto completo, montado a partir das páginas (None se ainda não extraído)"""
+        if self.page_count is None:
+            return None
+        return ''.join(page.text or '' for page in self.pages)
+
+    def set_pages(self, pages):
+        """Substitui o texto extraído pelo da lista de páginas (na ordem)"""
+        from .exam_page import ExamPage
+        self.pages = ExamPage.build(pages)
+        self.page_count = len(pages)
+        self.text_preview = ''.join(page_text or '' for page_text in pages)[:TEXT_PREVIEW_LENGTH]
+
+    def clear_pages(self):
+        """Remove o texto extraído (reprocessamento)"""
+        self.pages = []
+        self.page_count = None
+        self.text_preview = None
+
     # --- Utilidades de exibição ---
     def get_file_size_formatted(self):
         """Retorna tamanho do arquivo formatado"""
@@ -111,54 +157,94 @@ class Exam(db.Model):
         return self.file_type == 'pdf'
 
     def file_exists(self):
-        """Verifica se o arquivo ainda existe no sistema"""
+        """Verifica no disco se o arquivo ainda existe (a API usa file_available)"""
         return os.path.exists(self.file_path) if self.file_path else False
 
     # --- Serialização para API ---
-    def to_dict(self):
-        """Converte o objeto para dicionário"""
-        return {
-            'id': self.id,
-            'patient_id': self.patient_id,
-            'original_filename': self.original_filename,
-            'file_path': self.file_path,
-            'file_size': self.file_size,
-            'file_size_formatted': self.get_file_size_formatted(),
-            'file_type': self.file_type,
-            'mime_type': self.mime_type,
-            'exam_type': self.exam_type,
-            'exam_date': self.exam_date.isoformat() if self.exam_date else None,
-            'lab_name': self.lab_name,
-            'doctor_name': self.doctor_name,
-            'extracted_text': self.extracted_text,
-            'ai_analysis': self.get_ai_analysis(),
-            'extracted_values': self.get_extracted_values(),
-            'ai_summary': self.ai_summary,
-            'processing_status': self.processing_status,
-            'status_display': self.get_status_display(),
-            'processing_error': self.processing_error,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'processed_at': self.processed_at.isoformat() if self.processed_at else None,
-            'file_exists': self.file_exists()
-        }
+    # Campos da API (?fields=): colunas lidas e serializador de cada chave
+    FIELD_COLUMNS = {
+        'id': ('id',),
+        'patient_id': ('patient_id',),
+        'original_filename': ('original_filename',),
+        'file_path': ('file_path',),
+        'file_size': ('file_size',),
+        'file_size_formatted': ('file_size',),
+        'file_hash': ('file_hash',),
+        'file_type': ('file_type',),
+        'mime_type': ('mime_type',),
+        'exam_type': ('exam_type',),
+        'exam_date': ('exam_date',),
+        'lab_name': ('lab_name',),
+        'doctor_name': ('doctor_name',),
+        'extracted_text': ('page_count',),
+        'page_count': ('page_count',),
+        'text_preview': ('text_preview',),
+        'ai_analysis': ('ai_analysis',),
+        'extracted_values': ('extracted_values',),
+        'ai_summary': ('ai_summary',),
+        'processing_status': ('processing_status',),
+        'status_display': ('processing_status',),
+        'processing_error': ('processing_error',),
+        'created_at': ('created_at',),
+        'updated_at': ('updated_at',),
+        'processed_at': ('processed_at',),
+        'file_exists': ('file_available',),
+        'has_results': ('has_results',)
+    }
+
+    # Campos montados a partir de relacionamentos (carregados com selectinload)
+    FIELD_RELATIONSHIPS = {
+        'extracted_text': ('pages',)
+    }
+
+    FIELD_SERIALIZERS = {
+        'id': lambda e: e.id,
+        'patient_id': lambda e: e.patient_id,
+        'original_filename': lambda e: e.original_filename,
+        'file_path': lambda e: e.file_path,
+        'file_size': lambda e: e.file_size,
+        'file_size_formatted': lambda e: e.get_file_size_formatted(),
+        'file_hash': lambda e: e.file_hash,
+        'file_type': lambda e: e.file_type,
+        'mime_type': lambda e: e.mime_type,
+        'exam_type': lambda e: e.exam_type,
+        'exam_date': lambda e: e.exam_date.isoformat() if e.exam_date else None,
+        'lab_name': lambda e: e.lab_name,
+        'doctor_name': lambda e: e.doctor_name,
+        'extracted_text': lambda e: e.extracted_text,
+        'page_count': lambda e: e.page_count or 0,
+        'text_preview': lambda e: e.text_preview,
+        'ai_analysis': lambda e: e.get_ai_analysis(),
+        'extracted_values': lambda e: e.get_extracted_values(),
+        'ai_summary': lambda e: e.ai_summary,
+        'processing_status': lambda e: e.processing_status,
+        'status_display': lambda e: e.get_status_display(),
+        'processing_error': lambda e: e.processing_error,
+        'created_at': lambda e: e.created_at.isoformat() if e.created_at else None,
+        'updated_at': lambda e: e.updated_at.isoformat() if e.updated_at else None,
+        'processed_at': lambda e: e.processed_at.isoformat() if e.processed_at else None,
+        'file_exists': lambda e: bool(e.file_available),
+        'has_results': lambda e: bool(e.has_results)
+    }
+
+    # O texto completo fica fora do payload padrão: use text_preview, GET /exams/<id>/pages
+    # ou ?fields=extracted_text
+    DETAIL_FIELDS = ['id', 'patient_id', 'original_filename', 'file_path', 'file_size', 'file_size_formatted',
+                     'file_hash', 'file_type', 'mime_type', 'exam_type', 'exam_date', 'lab_name', 'doctor_name',
+                     'page_count', 'text_preview', 'ai_analysis', 'extracted_values', 'ai_summary',
+                     'processing_status', 'status_display', 'processing_error', 'created_at', 'updated_at',
+                     'processed_at', 'file_exists']
+    SUMMARY_FIELDS = ['id', 'patient_id', 'original_filename', 'file_type', 'file_size_formatted', 'exam_type',
+                      'exam_date', 'lab_name', 'processing_status', 'status_display', 'created_at', 'has_results',
+                      'page_count']
+
+    def to_dict(self, fields=None):
+        """Converte o objeto para dicionário (``fields`` restringe as chaves)"""
+        return self.serialize(fields or self.DETAIL_FIELDS)
 
     def to_summary_dict(self):
         """Converte para dicionário resumido (para listas)"""
-        return {
-            'id': self.id,
-            'patient_id': self.patient_id,
-            'original_filename': self.original_filename,
-            'file_type': self.file_type,
-            'file_size_formatted': self.get_file_size_formatted(),
-            'exam_type': self.exam_type,
-            'exam_date': self.exam_date.isoformat() if self.exam_date else None,
-            'lab_name': self.lab_name,
-            'processing_status': self.processing_status,
-            'status_display': self.get_status_display(),
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'has_results': bool(self.extracted_values or self.ai_summary)
-        }
+        return self.serialize(self.SUMMARY_FIELDS)
 
     # --- Consultas utilitárias ---
     @staticmethod
@@ -180,17 +266,28 @@ class Exam(db.Model):
         return Exam.query.filter_by(processing_status='pending').order_by(Exam.created_at.asc()).all()
 
     @staticmethod
-    def get_processing_stats():
-        """Retorna estatísticas de processamento"""
-        total = Exam.query.count()
-        pending = Exam.query.filter_by(processing_status='pending').count()
-        processing = Exam.query.filter_by(processing_status='processing').count()
-        completed = Exam.query.filter_by(processing_status='completed').count()
-        error = Exam.query.filter_by(processing_status='error').count()
-        return {
-            'total': total,
-            'pending': pending,
-            'processing': processing,
-            'completed': completed,
-            'error': error
-        }
+    def mark_file_available(file_hash):
+        """Marca como disponíveis os exames do arquivo (gravado de novo em disco)"""
+        if not file_hash:
+            return
+        db.session.execute(
+            db.update(Exam)
+            .where(Exam.file_hash == file_hash, Exam.file_available.is_(False))
+            .values(file_available=True, updated_at=datetime.utcnow())
+        )
+
+    @staticmethod
+    def get_processing_stats(patient_id=None):
+        """Retorna estatísticas de processamento (contadores mantidos, leitura O(1))"""
+        from .exam_counters import ExamStatusCounter
+        return ExamStatusCounter.get_stats(patient_id)
+
+
+@event.listens_for(Exam, 'before_insert')
+@event.listens_for(Exam, 'before_update')
+def _sync_has_results(mapper, connection, target):
+    """Mantém has_results coerente quando os resultados mudam"""
+    state = inspect(target)
+    if (state.attrs.extracted_values.history.has_changes()
+            or state.attrs.ai_summary.history.has_changes()):
+        target.has_results = bool(target.extracted_values or target.ai_summary)
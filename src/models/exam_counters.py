@@ -0,0 +1,255 @@
+from .db import db
+from .exam import Exam
+from .file_blob import FileBlob, is_blob_path
+from sqlalchemy import event, func, inspect, text
+from sqlalchemy.orm import Session
+
+GLOBAL_PATIENT_ID = 0  # linha com o total de todos os pacientes
+
+
+def status_key(value):
+    """Status usado nos contadores (exames antigos sem status contam como 'pending')"""
+    return value or 'pending'
+
+
+def upsert_increment(connection, table, keys, deltas):
+    """Soma ``deltas`` (coluna -> valor) na linha de ``keys``, criando-a se não existe.
+
+    Usa INSERT ... ON CONFLICT DO UPDATE (SQLite >= 3.24 e PostgreSQL), então
+    dois processos incrementando a mesma linha não se sobrescrevem.
+    """
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    statement = insert(table).values(**keys, **deltas)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: table.c[column] + statement.excluded[column] for column in deltas}
+    )
+    connection.execute(statement)
+
+
+def clear_for_rebuild(connection, table):
+    """Esvazia ``table`` para o rebuild, bloqueando os incrementos até o commit.
+
+    Sem o bloqueio, um exame gravado entre a leitura de exams e a regravação
+    dos contadores teria o incremento apagado e não entraria na contagem. Com
+    ele, transações que já incrementaram terminam antes (e entram na leitura
+    feita em seguida), e as novas esperam e somam depois do rebuild.
+    No PostgreSQL: LOCK TABLE (cobre também linhas que ainda não existem,
+    o que FOR UPDATE não faz). No SQLite o DELETE antes da leitura já pega o
+    lock de escrita do banco.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(f'LOCK TABLE {table.name} IN EXCLUSIVE MODE'))
+    connection.execute(table.delete())
+
+
+class ExamStatusCounter(db.Model):
+    """Quantidade de exames por status, por paciente e global (patient_id = 0).
+
+    Atualizada na mesma transação de cada inserção, remoção ou mudança de
+    status de exame (listeners de flush abaixo); rebuild() recalcula tudo.
+    """
+    __tablename__ = 'exam_status_counters'
+
+    patient_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def get_stats(patient_id=None):
+        """Contagens por status lidas dos contadores (sem varrer exams)"""
+        rows = db.session.execute(
+            db.select(ExamStatusCounter.status, ExamStatusCounter.count).where(
+                ExamStatusCounter.patient_id == (patient_id or GLOBAL_PATIENT_ID)
+            )
+        ).all()
+        stats = {'total': 0, 'pending': 0, 'processing': 0, 'completed': 0, 'error': 0}
+        for status, count in rows:
+            stats[status] = stats.get(status, 0) + count
+            stats['total'] += count
+        return stats
+
+    @staticmethod
+    def rebuild(connection):
+        """Recalcula todos os contadores a partir de exams (um GROUP BY), na transação de ``connection``"""
+        table = ExamStatusCounter.__table__
+        clear_for_rebuild(connection, table)
+        rows = connection.execute(
+            db.select(Exam.patient_id, Exam.processing_status, func.count(Exam.id))
+            .group_by(Exam.patient_id, Exam.processing_status)
+        ).all()
+
+        counts = {}
+        for patient_id, status, count in rows:
+            for key in ((patient_id, status_key(status)), (GLOBAL_PATIENT_ID, status_key(status))):
+                counts[key] = counts.get(key, 0) + count
+
+        if counts:
+            connection.execute(table.insert(), [
+                {'patient_id': patient_id, 'status': status, 'count': count}
+                for (patient_id, status), count in counts.items()
+            ])
+
+
+class StorageUsage(db.Model):
+    """Uso de armazenamento dos arquivos de exames, por paciente e global (patient_id = 0).
+
+    file_count/total_bytes são o tamanho lógico: a soma de Exam.file_size, que
+    conta de novo cada exame que compartilha um blob. O espaço em disco fica em
+    stored_files/stored_bytes, só na linha global: cada FileBlob soma ao ser
+    criado e subtrai ao ser apagado; arquivos fora de blobs/ (legado) são de um
+    exame só e entram com ele.
+
+    Mantida pelos mesmos listeners de flush dos contadores de status e por
+    FileBlob; o job reconcile_storage_usage recalcula tudo com rebuild().
+    """
+    __tablename__ = 'storage_usage'
+
+    patient_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    stored_files = db.Column(db.Integer, nullable=False, default=0)
+    stored_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @staticmethod
+    def get_stats(patient_id=None):
+        """Uso de armazenamento lido da linha do paciente (ou global), sem varrer disco nem exams.
+
+        total_* é o espaço em disco (só no global); logical_* soma o arquivo de cada exame.
+        """
+        row = db.session.get(StorageUsage, patient_id or GLOBAL_PATIENT_ID)
+        logical_bytes = row.total_bytes if row else 0
+        stats = {
+            'logical_files': row.file_count if row else 0,
+            'logical_size_bytes': logical_bytes,
+            'logical_size_mb': round(logical_bytes / (1024 * 1024), 2)
+        }
+        if not patient_id:
+            stored_bytes = row.stored_bytes if row else 0
+            stats.update({
+                'total_files': row.stored_files if row else 0,
+                'total_size_bytes': stored_bytes,
+                'total_size_mb': round(stored_bytes / (1024 * 1024), 2)
+            })
+        return stats
+
+    @staticmethod
+    def add_stored(connection, file_count, total_bytes):
+        """Soma arquivos gravados (ou, negativo, apagados) do disco na linha global"""
+        upsert_increment(connection, StorageUsage.__table__, {'patient_id': GLOBAL_PATIENT_ID},
+                         {'stored_files': file_count, 'stored_bytes': total_bytes})
+
+    @staticmethod
+    def rebuild(connection):
+        """Recalcula o uso a partir de exams (um GROUP BY) e de file_blobs, na transação de ``connection``"""
+        table = StorageUsage.__table__
+        clear_for_rebuild(connection, table)
+        rows = connection.execute(
+            db.select(Exam.patient_id, func.count(Exam.id), func.coalesce(func.sum(Exam.file_size), 0))
+            .group_by(Exam.patient_id)
+        ).all()
+
+        usage = {GLOBAL_PATIENT_ID: [0, 0]}
+        for patient_id, file_count, total_bytes in rows:
+            usage[patient_id] = [file_count, total_bytes]
+            usage[GLOBAL_PATIENT_ID][0] += file_count
+            usage[GLOBAL_PATIENT_ID][1] += total_bytes
+
+        stored = connection.execute(
+            db.select(func.count(FileBlob.id), func.coalesce(func.sum(FileBlob.file_size), 0))
+        ).one()
+        legacy = connection.execute(
+            db.select(func.count(Exam.id), func.coalesce(func.sum(Exam.file_size), 0))
+            .where(~db.select(FileBlob.id).where(FileBlob.file_path == Exam.file_path).exists())
+        ).one()
+
+        connection.execute(table.insert(), [
+            {'patient_id': patient_id, 'file_count': file_count, 'total_bytes': total_bytes,
+             'stored_files': 0, 'stored_bytes': 0}
+            for patient_id, (file_count, total_bytes) in usage.items()
+        ])
+        StorageUsage.add_stored(connection, stored[0] + legacy[0], stored[1] + legacy[1])
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_exam_deltas(session, flush_context, instances):
+    """Calcula as variações dos contadores causadas pelas mudanças pendentes.
+
+    Feito antes do flush: depois dele o status de um exame removido pode não
+    estar mais acessível. Os valores são aplicados em after_flush.
+    """
+    status_deltas = session.info.setdefault('exam_status_deltas', {})
+    storage_deltas = session.info.setdefault('storage_deltas', {})
+    stored_deltas = session.info.setdefault('stored_deltas', [0, 0])
+
+    def add_status(patient_id, status, delta):
+        for key in ((patient_id, status_key(status)), (GLOBAL_PATIENT_ID, status_key(status))):
+            status_deltas[key] = status_deltas.get(key, 0) + delta
+
+    def add_storage(patient_id, file_path, file_size, delta):
+        for key in (patient_id, GLOBAL_PATIENT_ID):
+            file_count, total_bytes = storage_deltas.get(key, (0, 0))
+            storage_deltas[key] = (file_count + delta, total_bytes + delta * (file_size or 0))
+        if file_path and not is_blob_path(file_path):
+            # Arquivo legado, de um exame só (blobs são contados por FileBlob)
+            file_count, total_bytes = stored_deltas
+            stored_deltas[:] = (file_count + delta, total_bytes + delta * (file_size or 0))
+
+    for obj in session.new:
+        if isinstance(obj, Exam):
+            add_status(obj.patient_id, obj.processing_status, 1)  # None = default 'pending'
+            add_storage(obj.patient_id, obj.file_path, obj.file_size, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Exam):
+            history = inspect(obj).attrs.processing_status.history
+            old_status = history.deleted[0] if history.deleted else obj.processing_status
+            add_status(obj.patient_id, old_status, -1)
+            add_storage(obj.patient_id, obj.file_path, obj.file_size, -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Exam) and obj not in session.deleted:
+            history = inspect(obj).attrs.processing_status.history
+            if not history.added:
+                continue
+            old_status = history.deleted[0] if history.deleted else None
+            if status_key(old_status) != status_key(history.added[0]):
+                add_status(obj.patient_id, old_status, -1)
+                add_status(obj.patient_id, history.added[0], 1)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_exam_deltas(session, flush_context):
+    """Grava as variações nos contadores, na mesma transação do flush"""
+    status_deltas = session.info.pop('exam_status_deltas', None) or {}
+    storage_deltas = session.info.pop('storage_deltas', None) or {}
+    stored_deltas = session.info.pop('stored_deltas', None) or [0, 0]
+    if (not any(status_deltas.values()) and not any(any(delta) for delta in storage_deltas.values())
+            and not any(stored_deltas)):
+        return
+
+    connection = session.connection()
+    table = ExamStatusCounter.__table__
+    for (patient_id, status), delta in sorted(status_deltas.items()):
+        if delta:
+            upsert_increment(connection, table, {'patient_id': patient_id, 'status': status}, {'count': delta})
+
+    table = StorageUsage.__table__
+    for patient_id, (file_count, total_bytes) in sorted(storage_deltas.items()):
+        if file_count or total_bytes:
+            upsert_increment(connection, table, {'patient_id': patient_id},
+                             {'file_count': file_count, 'total_bytes': total_bytes})
+    if any(stored_deltas):
+        StorageUsage.add_stored(connection, *stored_deltas)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_exam_deltas(session, previous_transaction):
+    """Flush que falhou: as variações calculadas não valem mais"""
+    session.info.pop('exam_status_deltas', None)
+    session.info.pop('storage_deltas', None)
+    session.info.pop('stored_deltas', None)
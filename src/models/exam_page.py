@@ -0,0 +1,43 @@
+from .compressed_text import CompressedText
+from .db import db
+
+COMPRESSED_PAGE_COLUMNS = ('text',)  # tipo CompressedText
+
+class ExamPage(db.Model):
+    """Texto extraído de uma página do exame (page_no começa em 1)"""
+    __tablename__ = 'exam_pages'
+
+    id = db.Column(db.Integer, primary_key=True)
+    exam_id = db.Column(db.Integer, db.ForeignKey('exams.id', ondelete='CASCADE'), nullable=False)
+    page_no = db.Column(db.Integer, nullable=False)
+    text = db.Column(CompressedText)  # comprimido; char_count guarda o tamanho sem descomprimir
+    char_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Uma linha por página; atende também a busca por faixa (exam_id, page_no BETWEEN)
+        db.UniqueConstraint('exam_id', 'page_no', name='uq_exam_pages_exam_id_page_no'),
+    )
+
+    def to_dict(self):
+        return {
+            'page_no': self.page_no,
+            'text': self.text,
+            'char_count': self.char_count
+        }
+
+    @staticmethod
+    def build(pages):
+        """Cria as linhas a partir da lista de textos por página (na ordem)"""
+        return [
+            ExamPage(page_no=index, text=page_text or '', char_count=len(page_text or ''))
+            for index, page_text in enumerate(pages, start=1)
+        ]
+
+    @staticmethod
+    def get_range(exam_id, start, end):
+        """Páginas [start, end] (inclusive) do exame, em ordem"""
+        return ExamPage.query.filter(
+            ExamPage.exam_id == exam_id,
+            ExamPage.page_no >= start,
+            ExamPage.page_no <= end
+        ).order_by(ExamPage.page_no).all()
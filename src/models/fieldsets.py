@@ -0,0 +1,86 @@
+from sqlalchemy.orm import load_only, selectinload
+
+
+class SparseFieldsMixin:
+    """Serialização por campos (?fields=) com carga apenas das colunas necessárias.
+
+    A classe que usa o mixin define ``FIELD_COLUMNS`` (chave da API -> colunas
+    que ela lê) e ``FIELD_SERIALIZERS`` (chave da API -> função que recebe a
+    instância e devolve o valor); ``FIELD_RELATIONSHIPS`` lista os
+    relacionamentos que um campo percorre, carregados numa consulta extra
+    para todos os registros em vez de um por registro. Também oferece a busca em lote por ids
+    (``get_many``), que reaproveita a mesma seleção de colunas.
+    """
+
+    FIELD_COLUMNS = {}
+    FIELD_RELATIONSHIPS = {}
+    FIELD_SERIALIZERS = {}
+    DETAIL_FIELDS = []
+
+    @classmethod
+    def parse_fields(cls, raw):
+        """Converte 'a,b' em ['a', 'b']; None se vazio, ValueError se houver campo desconhecido"""
+        if not raw:
+            return None
+
+        fields = []
+        for field in raw.split(','):
+            field = field.strip()
+            if field and field not in fields:
+                fields.append(field)
+
+        unknown = [field for field in fields if field not in cls.FIELD_SERIALIZERS]
+        if unknown:
+            raise ValueError(f"Campo(s) inválido(s) em fields: {', '.join(unknown)}")
+        return fields or None
+
+    @classmethod
+    def load_options(cls, fields):
+        """Opções de query que carregam só as colunas usadas pelos campos pedidos"""
+        if not fields:
+            return []
+
+        columns = {'id'}
+        relationships = set()
+        for field in fields:
+            columns.update(cls.FIELD_COLUMNS[field])
+            relationships.update(cls.FIELD_RELATIONSHIPS.get(field, ()))
+        return [load_only(*[getattr(cls, column) for column in sorted(columns)])] + [
+            selectinload(getattr(cls, relationship)) for relationship in sorted(relationships)
+        ]
+
+    @staticmethod
+    def parse_ids(raw, limit=500):
+        """Converte '1,2,3' (ou lista) em ids inteiros únicos, mantendo a ordem"""
+        if isinstance(raw, str):
+            raw = [part for part in raw.split(',') if part.strip()]
+        if not isinstance(raw, list) or not raw:
+            raise ValueError('Informe ao menos um id')
+
+        ids = []
+        seen = set()
+        for value in raw:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'Id inválido: {value}')
+            if value not in seen:
+                seen.add(value)
+                ids.append(value)
+
+        if len(ids) > limit:
+            raise ValueError(f'Máximo de {limit} ids por requisição')
+        return ids
+
+    @classmethod
+    def get_many(cls, ids, fields=None):
+        """Busca vários registros num único IN; retorna (encontrados na ordem pedida, ids ausentes)"""
+        rows = cls.query.options(*cls.load_options(fields or cls.DETAIL_FIELDS)).filter(cls.id.in_(ids)).all()
+        by_id = {row.id: row for row in rows}
+        found = [by_id[record_id] for record_id in ids if record_id in by_id]
+        missing = [record_id for record_id in ids if record_id not in by_id]
+        return found, missing
+
+    def serialize(self, fields):
+        """Calcula apenas as chaves pedidas, na ordem pedida"""
+        return {field: self.FIELD_SERIALIZERS[field](self) for field in fields}
@@ -0,0 +1,125 @@
+from .db import db
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+import os
+
+class FileBlob(db.Model):
+    """Arquivo armazenado por conteúdo (SHA-256), compartilhado entre exames"""
+    __tablename__ = 'file_blobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_path = db.Column(db.String(500), unique=True, nullable=False)
+    file_hash = db.Column(db.String(64), nullable=False, index=True)
+    file_size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # exames que usam o arquivo
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def acquire(file_path, file_hash, file_size):
+        """Registra mais uma referência ao arquivo (na transação do chamador)"""
+        from .exam_counters import StorageUsage
+        for _ in range(2):
+            updated = db.session.execute(
+                db.update(FileBlob)
+                .where(FileBlob.file_path == file_path)
+                .values(ref_count=FileBlob.ref_count + 1, updated_at=datetime.utcnow())
+            ).rowcount
+            if updated:
+                return
+
+            try:
+                with db.session.begin_nested():
+                    db.session.add(FileBlob(file_path=file_path, file_hash=file_hash,
+                                            file_size=file_size, ref_count=1))
+                    db.session.flush()
+                    StorageUsage.add_stored(db.session.connection(), 1, file_size or 0)
+                return
+            except IntegrityError:
+                continue  # outro upload criou a linha ao mesmo tempo: incrementa
+
+    @staticmethod
+    def release(file_path):
+        """Remove uma referência; retorna True se o arquivo ficou sem uso.
+
+        A linha fica com ref_count 0: o arquivo é apagado depois do commit por
+        delete_file_if_unused. Arquivos sem registro (uploads anteriores ao
+        armazenamento por conteúdo) pertencem a um único exame e também retornam True.
+        """
+        updated = db.session.execute(
+            db.update(FileBlob)
+            .where(FileBlob.file_path == file_path)
+            .values(ref_count=FileBlob.ref_count - 1, updated_at=datetime.utcnow())
+        ).rowcount
+        if not updated:
+            return True
+
+        remaining = db.session.execute(
+            db.select(FileBlob.ref_count).where(FileBlob.file_path == file_path)
+        ).scalar()
+        return remaining <= 0
+
+    @staticmethod
+    def delete_file_if_unused(file_path, delete_file):
+        """Apaga o arquivo se continua sem referências (transação própria, após o commit do chamador).
+
+        O DELETE condicional trava a linha até o commit, e o arquivo é apagado
+        antes dele: um upload do mesmo conteúdo espera em acquire e grava o
+        arquivo de novo depois; se o upload veio antes, ref_count > 0 e nada é
+        apagado. Arquivos fora de blobs/ (legado, um exame cada) são apagados direto.
+        """
+        if not is_blob_path(file_path):
+            delete_file(file_path)
+            return True
+
+        from .exam_counters import StorageUsage
+        try:
+            # O tamanho não muda: o caminho é o hash do conteúdo
+            file_size = db.session.execute(
+                db.select(FileBlob.file_size).where(FileBlob.file_path == file_path)
+            ).scalar()
+            deleted = db.session.execute(
+                db.delete(FileBlob).where(FileBlob.file_path == file_path, FileBlob.ref_count <= 0)
+            ).rowcount
+            if deleted:
+                StorageUsage.add_stored(db.session.connection(), -1, -(file_size or 0))
+                delete_file(file_path)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return bool(deleted)
+
+    @staticmethod
+    def discard_unreferenced(file_path, file_hash, file_size, delete_file):
+        """Apaga o arquivo de um upload revertido se nenhum exame o registrou (após o rollback).
+
+        Uma linha provisória trava o caminho enquanto o arquivo é apagado e
+        depois é descartada: um upload concorrente do mesmo conteúdo espera em
+        acquire e grava o arquivo de novo. Se a linha já existe, o arquivo é de
+        outro exame (ou de uma remoção pendente) e fica.
+        """
+        try:
+            db.session.add(FileBlob(file_path=file_path, file_hash=file_hash,
+                                    file_size=file_size, ref_count=0))
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        try:
+            delete_file(file_path)
+        finally:
+            db.session.rollback()
+        return True
+
+    @staticmethod
+    def unused_paths(limit=1000):
+        """Blobs com ref_count 0 (remoção interrompida antes de delete_file_if_unused)"""
+        return db.session.execute(
+            db.select(FileBlob.file_path).where(FileBlob.ref_count <= 0).limit(limit)
+        ).scalars().all()
+
+
+def is_blob_path(file_path):
+    """Arquivo armazenado por conteúdo (uploads/blobs/<hh>/<sha256>.<ext>)"""
+    return f'{os.sep}blobs{os.sep}' in os.path.normpath(file_path)
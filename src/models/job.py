@@ -0,0 +1,149 @@
+from .db import db
+from datetime import datetime, timedelta
+
+class Job(db.Model):
+    """Tarefa em segundo plano (fila persistida no banco)"""
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # ex.: 'process_exam'
+    exam_id = db.Column(db.Integer, index=True)  # alvo da tarefa, quando houver
+
+    # Estado: queued, running, completed, failed
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # backoff entre tentativas
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Seleção do próximo job pronto
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'exam_id': self.exam_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': self.run_after.isoformat() if self.run_after else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    # --- Ciclo de vida ---
+    @staticmethod
+    def enqueue(kind, exam_id=None, max_attempts=3):
+        """Adiciona um job à sessão atual (o commit fica com o chamador)"""
+        job = Job(kind=kind, exam_id=exam_id, max_attempts=max_attempts,
+                  status='queued', run_after=datetime.utcnow())
+        db.session.add(job)
+        return job
+
+    @staticmethod
+    def pending(kind, exam_id=None):
+        """Job ``kind`` do exame ainda na fila ou em execução, ou None"""
+        return Job.query.filter(
+            Job.kind == kind, Job.exam_id == exam_id, Job.status.in_(['queued', 'running'])
+        ).order_by(Job.id.desc()).first()
+
+    @staticmethod
+    def enqueue_periodic(kind, interval_seconds):
+        """Enfileira ``kind`` se não houver um pendente nem um criado no último intervalo.
+
+        Retorna o job criado ou None. Dois workers podem, raramente, criar o
+        mesmo job ao mesmo tempo: os jobs periódicos devem ser idempotentes.
+        """
+        since = datetime.utcnow() - timedelta(seconds=interval_seconds)
+        recent = db.session.execute(
+            db.select(Job.id).where(
+                Job.kind == kind,
+                db.or_(Job.status.in_(['queued', 'running']), Job.created_at >= since)
+            ).limit(1)
+        ).scalar()
+        if recent is not None:
+            db.session.rollback()
+            return None
+
+        job = Job.enqueue(kind)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def claim_next(worker_id):
+        """Reserva o próximo job pronto para este worker; retorna None se a fila está vazia.
+
+        No PostgreSQL a seleção usa FOR UPDATE SKIP LOCKED, então workers
+        concorrentes nunca disputam a mesma linha. No SQLite a reserva é um
+        UPDATE condicional (status ainda 'queued'): só um worker afeta a linha.
+        """
+        candidate = db.select(Job.id).where(
+            Job.status == 'queued',
+            Job.run_after <= datetime.utcnow()
+        ).order_by(Job.run_after, Job.id).limit(1)
+
+        if db.engine.dialect.name == 'postgresql':
+            candidate = candidate.with_for_update(skip_locked=True)
+
+        for _ in range(5):
+            job_id = db.session.execute(candidate).scalar()
+            if job_id is None:
+                db.session.rollback()
+                return None
+
+            now = datetime.utcnow()
+            claimed = db.session.execute(
+                db.update(Job)
+                .where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', locked_by=worker_id, locked_at=now,
+                        attempts=Job.attempts + 1, updated_at=now)
+            ).rowcount
+            db.session.commit()
+
+            if claimed:
+                return db.session.get(Job, job_id)
+
+        return None
+
+    def mark_completed(self):
+        self.status = 'completed'
+        self.last_error = None
+        self.locked_by = None
+        self.locked_at = None
+        self.finished_at = datetime.utcnow()
+
+    def mark_failed(self, error, backoff_seconds):
+        """Reagenda com backoff ou marca como falho quando as tentativas acabam"""
+        self.last_error = error
+        self.locked_by = None
+        self.locked_at = None
+        if self.attempts < self.max_attempts:
+            self.status = 'queued'
+            self.run_after = datetime.utcnow() + timedelta(seconds=backoff_seconds)
+        else:
+            self.status = 'failed'
+            self.finished_at = datetime.utcnow()
+
+    @staticmethod
+    def requeue_stale(lock_timeout_seconds):
+        """Devolve à fila jobs 'running' cujo worker morreu (lock expirado)"""
+        limit = datetime.utcnow() - timedelta(seconds=lock_timeout_seconds)
+        requeued = db.session.execute(
+            db.update(Job)
+            .where(Job.status == 'running', Job.locked_at < limit)
+            .values(status='queued', locked_by=None, locked_at=None,
+                    run_after=datetime.utcnow(), last_error='Lock expirado (worker interrompido)')
+        ).rowcount
+        db.session.commit()
+        return requeued
@@ -0,0 +1,279 @@
+from .db import db
+from .compressed_text import decompress_text
+from .exam import COMPRESSED_EXAM_COLUMNS, TEXT_PREVIEW_LENGTH
+from .exam_counters import ExamStatusCounter, StorageUsage
+from .exam_page import COMPRESSED_PAGE_COLUMNS, ExamPage
+from .patient import MEDICAL_LIST_FIELDS, cpf_digits_of, fold_text
+from datetime import datetime
+from sqlalchemy import LargeBinary, inspect, text
+from sqlalchemy.exc import DBAPIError
+import json
+
+# db.create_all() só cria tabelas que ainda não existem: colunas e índices
+# novos em tabelas já criadas precisam ser aplicados aqui. Todos os passos
+# são idempotentes e rodam a cada inicialização.
+
+
+def _run_once(connection, name, step):
+    """Executa uma migração de dados uma única vez, registrando em schema_migrations"""
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'name VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP)'
+    ))
+    applied = connection.execute(
+        text('SELECT 1 FROM schema_migrations WHERE name = :name'), {'name': name}
+    ).first()
+    if applied:
+        return
+
+    step(connection)
+    connection.execute(
+        text('INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :applied_at)'),
+        {'name': name, 'applied_at': datetime.utcnow()}
+    )
+
+
+def _add_missing_columns(connection):
+    """Adiciona colunas definidas nos modelos que ainda não existem no banco"""
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            ))
+
+
+def _create_missing_indexes(connection):
+    """Cria índices declarados nos modelos que ainda não existem"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _backfill_patient_search_name(connection):
+    """Preenche search_name de pacientes cadastrados antes da coluna existir"""
+    rows = connection.execute(text(
+        'SELECT id, full_name FROM patients WHERE search_name IS NULL'
+    )).fetchall()
+    if rows:
+        connection.execute(
+            text('UPDATE patients SET search_name = :search_name WHERE id = :id'),
+            [{'id': row.id, 'search_name': fold_text(row.full_name)} for row in rows]
+        )
+
+
+def _backfill_patient_cpf_digits(connection):
+    """Preenche cpf_digits de pacientes cadastrados antes da coluna existir"""
+    rows = connection.execute(text(
+        'SELECT id, cpf FROM patients WHERE cpf_digits IS NULL'
+    )).fetchall()
+    if rows:
+        connection.execute(
+            text('UPDATE patients SET cpf_digits = :cpf_digits WHERE id = :id'),
+            [{'id': row.id, 'cpf_digits': cpf_digits_of(row.cpf)} for row in rows]
+        )
+
+
+def _backfill_exam_has_results(connection):
+    """Preenche has_results de exames anteriores à coluna (mesma regra do modelo)"""
+    connection.execute(text(
+        "UPDATE exams SET has_results = CASE WHEN "
+        "(extracted_values IS NOT NULL AND extracted_values <> '') "
+        "OR (ai_summary IS NOT NULL AND ai_summary <> '') THEN :yes ELSE :no END "
+        "WHERE has_results IS NULL"
+    ), {'yes': True, 'no': False})
+
+
+def _backfill_exam_file_available(connection):
+    """Exames anteriores à coluna começam como disponíveis; o reconciliador corrige"""
+    connection.execute(
+        text('UPDATE exams SET file_available = :yes WHERE file_available IS NULL'), {'yes': True}
+    )
+
+
+def _migrate_patient_medical_lists(connection):
+    """Converte as listas médicas de texto JSON para coluna JSON/JSONB.
+
+    Valores que não são JSON válido (texto livre legado) viram lista com um
+    item, para que o tipo JSON consiga decodificá-los.
+    """
+    for column in MEDICAL_LIST_FIELDS:
+        rows = connection.execute(text(
+            f'SELECT id, {column} AS value FROM patients WHERE {column} IS NOT NULL'
+        )).fetchall()
+
+        fixes = []
+        for row in rows:
+            if not isinstance(row.value, str):
+                continue  # já é JSONB
+            if not row.value.strip():
+                fixes.append({'id': row.id, 'value': None})
+                continue
+            try:
+                json.loads(row.value)
+            except ValueError:
+                fixes.append({'id': row.id, 'value': json.dumps([row.value])})
+
+        if fixes:
+            connection.execute(
+                text(f'UPDATE patients SET {column} = :value WHERE id = :id'), fixes
+            )
+
+        # No SQLite o tipo da coluna não muda (JSON é armazenado como texto)
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text(
+                f'ALTER TABLE patients ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb'
+            ))
+
+
+def _has_column(connection, table, column):
+    return column in {c['name'] for c in inspect(connection).get_columns(table)}
+
+
+def _migrate_exam_pages(connection):
+    """Copia o texto de exames antigos (exams.extracted_text) para exam_pages.
+
+    O texto desses exames não tem divisão por página: vira uma página única.
+    Bancos criados sem a coluna não têm o que copiar. Roda depois de
+    exam_pages_compressed_text (exam_pages.text já binária no PostgreSQL).
+    """
+    if not _has_column(connection, 'exams', 'extracted_text'):
+        return
+    rows = connection.execute(text(
+        'SELECT id, extracted_text FROM exams WHERE extracted_text IS NOT NULL '
+        'AND NOT EXISTS (SELECT 1 FROM exam_pages WHERE exam_pages.exam_id = exams.id)'
+    )).fetchall()
+    pages = [{'exam_id': row.id, 'text': decompress_text(row.extracted_text)} for row in rows]
+    if not pages:
+        return
+    # Pela tabela do modelo: o texto é gravado comprimido (CompressedText), como no ORM
+    connection.execute(ExamPage.__table__.insert(), [
+        dict(page, page_no=1, char_count=len(page['text'])) for page in pages
+    ])
+    connection.execute(text(
+        'UPDATE exams SET page_count = 1, text_preview = :preview WHERE id = :exam_id'
+    ), [{'exam_id': page['exam_id'], 'preview': page['text'][:TEXT_PREVIEW_LENGTH]} for page in pages])
+
+
+def _drop_exam_extracted_text(connection):
+    """Remove exams.extracted_text: o texto completo fica só em exam_pages.
+
+    Copia antes o texto de exames que ainda não têm páginas. Sem DROP COLUMN
+    (SQLite < 3.35), a coluna fica, vazia.
+    """
+    if not _has_column(connection, 'exams', 'extracted_text'):
+        return
+    _migrate_exam_pages(connection)
+    try:
+        with connection.begin_nested():
+            connection.execute(text('ALTER TABLE exams DROP COLUMN extracted_text'))
+    except DBAPIError:
+        connection.execute(text('UPDATE exams SET extracted_text = NULL'))
+
+
+def _convert_to_bytea(connection, table, columns):
+    """Muda colunas CompressedText para BYTEA no PostgreSQL.
+
+    O texto existente vira UTF-8 puro, que CompressedText lê como está; a
+    compressão das linhas antigas é feita aos poucos por src/compress_exam_text.py.
+    No SQLite nada muda: a coluna TEXT aceita os valores binários.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    types = {c['name']: c['type'] for c in inspect(connection).get_columns(table)}
+    for column in columns:
+        if not isinstance(types[column], LargeBinary):
+            connection.execute(text(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BYTEA USING convert_to({column}, 'UTF8')"
+            ))
+
+
+def _migrate_exam_compressed_columns(connection):
+    _convert_to_bytea(connection, 'exams', COMPRESSED_EXAM_COLUMNS)
+
+
+def _migrate_exam_page_compressed_columns(connection):
+    """Antes das migrações que copiam texto para exam_pages (gravam bytes comprimidos)"""
+    _convert_to_bytea(connection, 'exam_pages', COMPRESSED_PAGE_COLUMNS)
+
+
+def _setup_patient_name_index(connection):
+    """Cria o índice n-gram da busca por nome (FTS5 trigram ou pg_trgm)"""
+    dialect = connection.dialect.name
+
+    if dialect == 'sqlite':
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'"
+        )).first()
+        if exists:
+            return
+        try:
+            # Tabela de conteúdo externo: o texto continua só em patients.search_name
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE patients_fts USING fts5("
+                "search_name, content='patients', content_rowid='id', tokenize='trigram')"
+            ))
+        except DBAPIError:
+            # SQLite sem FTS5/trigram (< 3.34): busca cai para LIKE
+            return
+        connection.execute(text(
+            "CREATE TRIGGER patients_fts_ai AFTER INSERT ON patients BEGIN "
+            "INSERT INTO patients_fts(rowid, search_name) VALUES (new.id, new.search_name); "
+            "END"
+        ))
+        connection.execute(text(
+            "CREATE TRIGGER patients_fts_ad AFTER DELETE ON patients BEGIN "
+            "INSERT INTO patients_fts(patients_fts, rowid, search_name) "
+            "VALUES ('delete', old.id, old.search_name); "
+            "END"
+        ))
+        connection.execute(text(
+            "CREATE TRIGGER patients_fts_au AFTER UPDATE OF search_name ON patients BEGIN "
+            "INSERT INTO patients_fts(patients_fts, rowid, search_name) "
+            "VALUES ('delete', old.id, old.search_name); "
+            "INSERT INTO patients_fts(rowid, search_name) VALUES (new.id, new.search_name); "
+            "END"
+        ))
+        connection.execute(text("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')"))
+
+    elif dialect == 'postgresql':
+        try:
+            with connection.begin_nested():
+                connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        except DBAPIError:
+            # Sem permissão para criar a extensão: busca cai para LIKE
+            return
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_patients_search_name_trgm '
+            'ON patients USING gin (search_name gin_trgm_ops)'
+        ))
+
+
+def run_migrations():
+    """Aplica ajustes de schema pendentes (chamar dentro do app context)"""
+    with db.engine.begin() as connection:
+        _add_missing_columns(connection)
+        _backfill_patient_search_name(connection)
+        _backfill_patient_cpf_digits(connection)
+        _backfill_exam_has_results(connection)
+        _backfill_exam_file_available(connection)
+        _run_once(connection, 'patients_medical_lists_json', _migrate_patient_medical_lists)
+        _run_once(connection, 'exam_pages_compressed_text', _migrate_exam_page_compressed_columns)
+        _run_once(connection, 'exam_pages_from_extracted_text', _migrate_exam_pages)
+        _run_once(connection, 'exams_compressed_text', _migrate_exam_compressed_columns)
+        _run_once(connection, 'exams_drop_extracted_text', _drop_exam_extracted_text)
+        _run_once(connection, 'exam_status_counters', ExamStatusCounter.rebuild)
+        _run_once(connection, 'storage_usage', StorageUsage.rebuild)
+        _run_once(connection, 'storage_usage_stored_bytes', StorageUsage.rebuild)
+        _create_missing_indexes(connection)
+        _setup_patient_name_index(connection)
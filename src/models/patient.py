@@ -1,15 +1,44 @@
 from .db import db
+from .fieldsets import SparseFieldsMixin
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
+import base64
 import json
+import re
+import unicodedata
 
-class Patient(db.Model):
+
+def fold_text(value):
+    """Normaliza texto para busca: sem acentos, minúsculo e espaços simples"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.lower().split())
+
+
+def cpf_digits_of(value):
+    """Retorna apenas os dígitos de um CPF (com ou sem pontuação)"""
+    return re.sub(r'[^0-9]', '', value or '')
+
+
+# Listas médicas: JSONB no PostgreSQL, JSON (texto) nos demais. O driver
+# decodifica uma única vez ao carregar a linha; None grava NULL no banco.
+MedicalList = db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql')
+
+MEDICAL_LIST_FIELDS = ('allergies', 'chronic_diseases', 'previous_surgeries', 'family_history', 'current_medications')
+
+
+class Patient(SparseFieldsMixin, db.Model):
     __tablename__ = 'patients'
     
     id = db.Column(db.Integer, primary_key=True)
     
     # Informações Pessoais
     full_name = db.Column(db.String(200), nullable=False)
+    search_name = db.Column(db.String(200), index=True)  # full_name normalizado (fold_text), mantido via validates
     cpf = db.Column(db.String(14), unique=True, nullable=False)
+    cpf_digits = db.Column(db.String(11), unique=True, index=True)  # CPF só com dígitos, mantido via validates
     birth_date = db.Column(db.Date, nullable=False)
     gender = db.Column(db.String(20), nullable=False)
     phone = db.Column(db.String(20))
@@ -25,11 +54,11 @@ class Patient(db.Model):
     address_zipcode = db.Column(db.String(10))
     
     # Informações Médicas
-    allergies = db.Column(db.Text)  # JSON string com lista de alergias
-    chronic_diseases = db.Column(db.Text)  # JSON string com lista de doenças crônicas
-    previous_surgeries = db.Column(db.Text)  # JSON string com lista de cirurgias
-    family_history = db.Column(db.Text)  # JSON string com histórico familiar
-    current_medications = db.Column(db.Text)  # JSON string com medicações atuais
+    allergies = db.Column(MedicalList)  # lista de alergias
+    chronic_diseases = db.Column(MedicalList)  # lista de doenças crônicas
+    previous_surgeries = db.Column(MedicalList)  # lista de cirurgias
+    family_history = db.Column(MedicalList)  # histórico familiar
+    current_medications = db.Column(MedicalList)  # medicações atuais
     
     # Hábitos de Vida
     smoking = db.Column(db.String(20))  # 'never', 'former', 'current'
@@ -41,78 +70,60 @@ class Patient(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def __init__(self, **kwargs):
-        # Converte listas para JSON strings
-        for field in ['allergies', 'chronic_diseases', 'previous_surgeries', 'family_history', 'current_medications']:
-            if field in kwargs and isinstance(kwargs[field], list):
-                kwargs[field] = json.dumps(kwargs[field])
-        
-        super(Patient, self).__init__(**kwargs)
+    __table_args__ = (
+        # Ordenação/keyset da listagem paginada
+        db.Index('ix_patients_full_name_id', 'full_name', 'id'),
+    )
+    
+    @db.validates('full_name')
+    def _sync_search_name(self, key, value):
+        self.search_name = fold_text(value)
+        return value
+    
+    @db.validates('cpf')
+    def _sync_cpf_digits(self, key, value):
+        self.cpf_digits = cpf_digits_of(value)
+        return value
     
     def get_allergies(self):
         """Retorna lista de alergias"""
-        if self.allergies:
-            try:
-                return json.loads(self.allergies)
-            except:
-                return []
-        return []
+        return self.allergies or []
     
     def set_allergies(self, allergies_list):
         """Define lista de alergias"""
-        self.allergies = json.dumps(allergies_list) if allergies_list else None
+        self.allergies = allergies_list or None
     
     def get_chronic_diseases(self):
         """Retorna lista de doenças crônicas"""
-        if self.chronic_diseases:
-            try:
-                return json.loads(self.chronic_diseases)
-            except:
-                return []
-        return []
+        return self.chronic_diseases or []
     
     def set_chronic_diseases(self, diseases_list):
         """Define lista de doenças crônicas"""
-        self.chronic_diseases = json.dumps(diseases_list) if diseases_list else None
+        self.chronic_diseases = diseases_list or None
     
     def get_previous_surgeries(self):
         """Retorna lista de cirurgias prévias"""
-        if self.previous_surgeries:
-            try:
-                return json.loads(self.previous_surgeries)
-            except:
-                return []
-        return []
+        return self.previous_surgeries or []
     
     def set_previous_surgeries(self, surgeries_list):
         """Define lista de cirurgias prévias"""
-        self.previous_surgeries = json.dumps(surgeries_list) if surgeries_list else None
+        self.previous_surgeries = surgeries_list or None
     
     def get_family_history(self):
         """Retorna histórico familiar"""
-        if self.family_history:
-            try:
-                return json.loads(self.family_history)
-            except:
-                return []
-        return []
+        return self.family_history or []
     
     def set_family_history(self, history_list):
         """Define histórico familiar"""
-        self.family_history = json.dumps(history_list) if history_list else None
+        self.family_history = history_list or None
     
     def get_current_medications(self):
         """Retorna medicações atuais"""
-        if self.current_medications:
-            try:
-                return json.loads(self.current_medications)
-            except:
-                return []
-        return []
+        return self.current_medications or []
     
     def set_current_medications(self, medications_list):
         """Define medicações atuais"""
-        self.current_medications = json.dumps(medications_list) if medications_list else None
+        self.current_medications = medications_list or None
     
     def get_age(self):
         """Calcula idade do paciente"""
@@ -144,75 +155,216 @@ class Patient(db.Model):
         
         return " - ".join(address_parts) if address_parts else ""
     
-    def to_dict(self):
-        """Converte o objeto para dicionário"""
+    def _address_dict(self):
         return {
-            'id': self.id,
-            'full_name': self.full_name,
-            'cpf': self.cpf,
-            'birth_date': self.birth_date.isoformat() if self.birth_date else None,
-            'age': self.get_age(),
-            'gender': self.gender,
-            'phone': self.phone,
-            'email': self.email,
-            'address': {
-                'street': self.address_street,
-                'number': self.address_number,
-                'complement': self.address_complement,
-                'neighborhood': self.address_neighborhood,
-                'city': self.address_city,
-                'state': self.address_state,
-                'zipcode': self.address_zipcode,
-                'full_address': self.get_full_address()
-            },
-            'medical_info': {
-                'allergies': self.get_allergies(),
-                'chronic_diseases': self.get_chronic_diseases(),
-                'previous_surgeries': self.get_previous_surgeries(),
-                'family_history': self.get_family_history(),
-                'current_medications': self.get_current_medications()
-            },
-            'lifestyle': {
-                'smoking': self.smoking,
-                'alcohol_consumption': self.alcohol_consumption,
-                'physical_activity': self.physical_activity
-            },
-            'active': self.active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'street': self.address_street,
+            'number': self.address_number,
+            'complement': self.address_complement,
+            'neighborhood': self.address_neighborhood,
+            'city': self.address_city,
+            'state': self.address_state,
+            'zipcode': self.address_zipcode,
+            'full_address': self.get_full_address()
         }
     
-    def to_summary_dict(self):
-        """Converte para dicionário resumido (para listas)"""
+    def _medical_info_dict(self):
         return {
-            'id': self.id,
-            'full_name': self.full_name,
-            'cpf': self.cpf,
-            'age': self.get_age(),
-            'gender': self.gender,
-            'phone': self.phone,
-            'email': self.email,
-            'city': self.address_city,
-            'active': self.active,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'allergies': self.get_allergies(),
+            'chronic_diseases': self.get_chronic_diseases(),
+            'previous_surgeries': self.get_previous_surgeries(),
+            'family_history': self.get_family_history(),
+            'current_medications': self.get_current_medications()
         }
     
+    def _lifestyle_dict(self):
+        return {
+            'smoking': self.smoking,
+            'alcohol_consumption': self.alcohol_consumption,
+            'physical_activity': self.physical_activity
+        }
+    
+    # Campos da API (?fields=): colunas lidas e serializador de cada chave
+    FIELD_COLUMNS = {
+        'id': ('id',),
+        'full_name': ('full_name',),
+        'cpf': ('cpf',),
+        'birth_date': ('birth_date',),
+        'age': ('birth_date',),
+        'gender': ('gender',),
+        'phone': ('phone',),
+        'email': ('email',),
+        'city': ('address_city',),
+        'address': ('address_street', 'address_number', 'address_complement', 'address_neighborhood',
+                    'address_city', 'address_state', 'address_zipcode'),
+        'medical_info': MEDICAL_LIST_FIELDS,
+        'lifestyle': ('smoking', 'alcohol_consumption', 'physical_activity'),
+        'active': ('active',),
+        'created_at': ('created_at',),
+        'updated_at': ('updated_at',)
+    }
+    
+    FIELD_SERIALIZERS = {
+        'id': lambda p: p.id,
+        'full_name': lambda p: p.full_name,
+        'cpf': lambda p: p.cpf,
+        'birth_date': lambda p: p.birth_date.isoformat() if p.birth_date else None,
+        'age': lambda p: p.get_age(),
+        'gender': lambda p: p.gender,
+        'phone': lambda p: p.phone,
+        'email': lambda p: p.email,
+        'city': lambda p: p.address_city,
+        'address': lambda p: p._address_dict(),
+        'medical_info': lambda p: p._medical_info_dict(),
+        'lifestyle': lambda p: p._lifestyle_dict(),
+        'active': lambda p: p.active,
+        'created_at': lambda p: p.created_at.isoformat() if p.created_at else None,
+        'updated_at': lambda p: p.updated_at.isoformat() if p.updated_at else None
+    }
+    
+    DETAIL_FIELDS = ['id', 'full_name', 'cpf', 'birth_date', 'age', 'gender', 'phone', 'email',
+                     'address', 'medical_info', 'lifestyle', 'active', 'created_at', 'updated_at']
+    SUMMARY_FIELDS = ['id', 'full_name', 'cpf', 'age', 'gender', 'phone', 'email', 'city',
+                      'active', 'created_at']
+    
+    def to_dict(self, fields=None):
+        """Converte o objeto para dicionário (``fields`` restringe as chaves)"""
+        return self.serialize(fields or self.DETAIL_FIELDS)
+    
+    def to_summary_dict(self):
+        """Converte para dicionário resumido (para listas)"""
+        return self.serialize(self.SUMMARY_FIELDS)
+    
+    # Backend de busca por nome: 'fts5' (SQLite), 'trgm' (PostgreSQL) ou 'like'
+    _name_search_backend = None
+
+    @classmethod
+    def name_search_backend(cls):
+        """Detecta (uma vez por processo) o índice n-gram disponível"""
+        if cls._name_search_backend is None:
+            dialect = db.engine.dialect.name
+            backend = 'like'
+            if dialect == 'sqlite':
+                found = db.session.execute(db.text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'"
+                )).first()
+                backend = 'fts5' if found else 'like'
+            elif dialect == 'postgresql':
+                found = db.session.execute(db.text(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                )).first()
+                backend = 'trgm' if found else 'like'
+            cls._name_search_backend = backend
+        return cls._name_search_backend
+
+    @staticmethod
+    def encode_cursor(payload):
+        """Gera cursor opaco a partir de um dicionário de posição"""
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decodifica cursor gerado por encode_cursor.
+
+        Retorna ``('keyset', (full_name, id))`` ou ``('offset', n)``.
+        """
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if 'offset' in payload:
+                return 'offset', max(int(payload['offset']), 0)
+            full_name, patient_id = payload['after']
+            return 'keyset', (str(full_name), int(patient_id))
+        except (ValueError, TypeError, KeyError):
+            raise ValueError('Cursor inválido')
+
+    @staticmethod
+    def _prefix_range(column, prefix):
+        """Filtro de prefixo como faixa [prefix, prefix + U+FFFF), que usa índice B-tree"""
+        return db.and_(column >= prefix, column < prefix + '\uffff')
+
+    @staticmethod
+    def _filter_by_name(search_filter, query):
+        """Aplica busca por nome sem acentos; retorna (query, ordenação por relevância)"""
+        folded = fold_text(query)
+        
+        # Trigramas exigem ao menos 3 caracteres; abaixo disso, prefixo por faixa (usa índice B-tree)
+        if len(folded) < 3:
+            return search_filter.filter(Patient._prefix_range(Patient.search_name, folded)), []
+        
+        backend = Patient.name_search_backend()
+        if backend == 'fts5':
+            fts = db.table('patients_fts', db.column('rowid'), db.column('rank'))
+            phrase = '"' + folded.replace('"', '""') + '"'
+            matches = db.select(
+                fts.c.rowid.label('patient_id'),
+                fts.c.rank.label('rank')
+            ).where(
+                db.text('patients_fts MATCH :name_query').bindparams(name_query=phrase)
+            ).subquery()
+            search_filter = search_filter.join(matches, matches.c.patient_id == Patient.id)
+            return search_filter, [matches.c.rank]
+        
+        search_filter = search_filter.filter(Patient.search_name.contains(folded, autoescape=True))
+        if backend == 'trgm':
+            return search_filter, [db.func.similarity(Patient.search_name, folded).desc()]
+        return search_filter, []
+
     @staticmethod
-    def search(query, active_only=True):
-        """Busca pacientes por nome ou CPF"""
+    def search(query, active_only=True, page=1, per_page=20, cursor=None, with_total=True, options=None):
+        """Busca pacientes por nome ou CPF, paginando no banco.
+
+        Nomes são buscados sem acentos no índice n-gram e ordenados por
+        relevância; sem termo de busca a listagem usa keyset em
+        (full_name, id), com o mesmo custo em qualquer profundidade.
+        Retorna ``(pacientes, total, next_cursor)``; ``total`` é None quando
+        ``with_total`` é falso. ``options`` (ex.: load_only) vale só para a página.
+        """
         search_filter = Patient.query
         
         if active_only:
             search_filter = search_filter.filter(Patient.active == True)
         
+        ranking = []
         if query:
-            search_pattern = f"%{query}%"
-            search_filter = search_filter.filter(
-                db.or_(
-                    Patient.full_name.ilike(search_pattern),
-                    Patient.cpf.like(search_pattern)
+            if re.fullmatch(r'[\d.\-\s]*\d[\d.\-\s]*', query):
+                # CPF digitado com ou sem pontuação: prefixo sobre a coluna indexada
+                search_filter = search_filter.filter(
+                    Patient._prefix_range(Patient.cpf_digits, cpf_digits_of(query))
                 )
-            )
+            else:
+                search_filter, ranking = Patient._filter_by_name(search_filter, query)
+        
+        total = None
+        if with_total:
+            total = search_filter.order_by(None).with_entities(db.func.count(Patient.id)).scalar()
+        
+        page_query = search_filter.order_by(*ranking, Patient.full_name, Patient.id)
+        if options:
+            page_query = page_query.options(*options)
+        offset = (page - 1) * per_page
+        if cursor:
+            mode, position = Patient.decode_cursor(cursor)
+            if mode == 'keyset' and not ranking:
+                last_name, last_id = position
+                page_query = page_query.filter(
+                    db.tuple_(Patient.full_name, Patient.id) > db.tuple_(last_name, last_id)
+                )
+                offset = 0
+            elif mode == 'offset':
+                offset = position
+            else:
+                raise ValueError('Cursor inválido')
+        page_query = page_query.offset(offset) if offset else page_query
+        
+        # Busca um registro extra só para saber se existe próxima página
+        patients = page_query.limit(per_page + 1).all()
+        next_cursor = None
+        if len(patients) > per_page:
+            patients = patients[:per_page]
+            # Resultados ordenados por relevância não têm chave estável: cursor por offset
+            if ranking:
+                next_cursor = Patient.encode_cursor({'offset': offset + per_page})
+            else:
+                next_cursor = Patient.encode_cursor({'after': [patients[-1].full_name, patients[-1].id]})
         
-        return search_filter.order_by(Patient.full_name).all()
+        return patients, total, next_cursor
 
@@ -0,0 +1,40 @@
+from flask import current_app, request
+from datetime import timezone
+import hashlib
+
+# Helpers de GET condicional (ETag / Last-Modified) compartilhados pelas rotas.
+# O fluxo é: consultar só o timestamp do recurso, montar o ETag, devolver 304
+# se o cliente já tem essa versão e só então carregar/serializar o corpo.
+
+
+def make_etag(*parts):
+    """Gera ETag forte a partir das partes que identificam a versão do recurso"""
+    raw = '|'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _as_utc(value):
+    return value.replace(tzinfo=timezone.utc, microsecond=0) if value else None
+
+
+def not_modified_response(etag, last_modified=None):
+    """Retorna uma resposta 304 se a requisição já tem esta versão; senão None"""
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif last_modified and request.if_modified_since:
+        matched = _as_utc(last_modified) <= request.if_modified_since
+    else:
+        matched = False
+
+    if not matched:
+        return None
+    return with_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None):
+    """Adiciona ETag/Last-Modified e exige revalidação a cada uso"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = _as_utc(last_modified)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -1,13 +1,24 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, current_app, request, jsonify, send_file
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from src.models.exam import Exam
+from src.models.exam_counters import StorageUsage
+from src.models.exam_page import ExamPage
+from src.models.file_blob import FileBlob
+from src.models.job import Job
 from src.models import db
 from src.models.patient import Patient
+from src.routes.conditional import make_etag, not_modified_response, with_validators
 from src.services.file_service_simple import FileService
 from src.services.ai_service_simple import AIService
+from src.services.ocr_service import ocr_service
+from src.services.preview_service import preview_service
 from datetime import datetime
+from urllib.parse import quote
+import mimetypes
 import os
-import threading
+import re
 
 exam_bp = Blueprint('exam', __name__)
 
@@ -15,40 +26,19 @@ exam_bp = Blueprint('exam', __name__)
 file_service = FileService(upload_folder='uploads')
 ai_service = AIService()
 
-def _process_exam_now(exam: Exam):
-    """
-    Processa o exame imediatamente:
-    - Extrai texto do arquivo (PDF/Imagem) usando FileService (versão 'simple')
-    - Atualiza status e timestamps
-    - Preenche campos básicos (summary/análise placeholders)
-    """
-    try:
-        exam.processing_status = "processing"
-        db.session.commit()
+# Entrega de arquivos (/files): 'app' (o próprio Flask), 'x-accel-redirect' (nginx)
+# ou 'x-sendfile' (Apache/lighttpd)
+FILE_SERVING_MODE = os.environ.get('FILE_SERVING_MODE', 'app')
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected-uploads/')
+FILE_CACHE_MAX_AGE = int(os.environ.get('FILE_CACHE_MAX_AGE', 365 * 24 * 3600))
+BLOB_FILE_NAME = re.compile(r'^blobs/[0-9a-f]{2}/([0-9a-f]{64})\.[a-z0-9]+$')
 
-        text, err = file_service.extract_text_from_file(exam.file_path, exam.file_type)
-        if err:
-            exam.processing_status = "error"
-            exam.processing_error = err
-            exam.processed_at = datetime.utcnow()
-            db.session.commit()
-            return
+# Máximo de páginas por chamada de GET /exams/<id>/pages
+PAGES_PER_REQUEST = 50
 
-        # Campos básicos (ajuste se o seu AIService tiver métodos reais)
-        exam.extracted_text = text or ""
-        exam.extracted_values = {}   # implementar parsing depois, se quiser
-        exam.ai_analysis = {}        # idem
-        exam.ai_summary = "Resumo automático: texto extraído disponível." if text else "Sem texto extraído."
-        exam.processing_status = "completed"
-        exam.processing_error = None
-        exam.processed_at = datetime.utcnow()
-        db.session.commit()
-
-    except Exception as e:
-        exam.processing_status = "error"
-        exam.processing_error = str(e)
-        exam.processed_at = datetime.utcnow()
-        db.session.commit()
+# Upload em lote
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get('BATCH_UPLOAD_MAX_FILES', 20))
+BATCH_UPLOAD_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_UPLOAD_MAX_CONTENT_LENGTH', 200 * 1024 * 1024))
 
 @exam_bp.route('/patients/<int:patient_id>/exams', methods=['GET'])
 def get_patient_exams(patient_id):
@@ -66,9 +56,16 @@ def get_patient_exams(patient_id):
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
         status_filter = request.args.get('status', '')
+        try:
+            fields = Exam.parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
-        # Query base
-        query = Exam.query.filter_by(patient_id=patient_id)
+        # Query base (com fields, só as colunas usadas são lidas)
+        query = Exam.query.filter_by(patient_id=patient_id).options(*Exam.load_options(fields))
         
         # Filtro por status
         if status_filter:
@@ -84,7 +81,7 @@ def get_patient_exams(patient_id):
         
         return jsonify({
             'success': True,
-            'exams': [exam.to_summary_dict() for exam in exams],
+            'exams': [exam.serialize(fields) if fields else exam.to_summary_dict() for exam in exams],
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -100,9 +97,57 @@ def get_patient_exams(patient_id):
             'error': str(e)
         }), 500
 
+def _create_exam(patient_id, file_info, form, processing_status='pending'):
+    """Cria o exame do arquivo salvo (com os dados opcionais do formulário) e registra o blob"""
+    exam_data = {
+        'patient_id': patient_id,
+        'original_filename': file_info['original_filename'],
+        'file_path': file_info['file_path'],
+        'file_size': file_info['file_size'],
+        'file_hash': file_info['file_hash'],
+        'file_type': file_info['file_type'],
+        'mime_type': file_info['mime_type'],
+        'processing_status': processing_status
+    }
+    
+    # Adiciona informações opcionais do formulário
+    if 'exam_type' in form:
+        exam_data['exam_type'] = form['exam_type']
+    
+    if 'exam_date' in form and form['exam_date']:
+        try:
+            exam_data['exam_date'] = datetime.strptime(form['exam_date'], '%Y-%m-%d').date()
+        except:
+            pass
+    
+    if 'lab_name' in form:
+        exam_data['lab_name'] = form['lab_name']
+    
+    if 'doctor_name' in form:
+        exam_data['doctor_name'] = form['doctor_name']
+    
+    exam = Exam(**exam_data)
+    db.session.add(exam)
+    # Referência antes do arquivo: trava a linha do blob contra uma remoção concorrente
+    FileBlob.acquire(file_info['file_path'], file_info['file_hash'], file_info['file_size'])
+    file_service.store_file(file_info)
+    Exam.mark_file_available(file_info['file_hash'])
+    return exam
+
+def _discard_upload(file_info):
+    """Remove os arquivos de um upload cuja transação foi revertida (chamar após o rollback)"""
+    file_service.discard_file(file_info)
+    if file_info and file_info.get('stored'):
+        try:
+            FileBlob.discard_unreferenced(file_info['file_path'], file_info['file_hash'],
+                                          file_info['file_size'], file_service.delete_file)
+        except Exception as e:
+            print(f"Erro ao remover arquivo de upload revertido: {e}")
+
 @exam_bp.route('/patients/<int:patient_id>/exams', methods=['POST'])
 def upload_exam(patient_id):
     """Upload de novo exame"""
+    file_info = None
     try:
         # Verifica se paciente existe
         patient = Patient.query.get(patient_id)
@@ -136,47 +181,150 @@ def upload_exam(patient_id):
             }), 400
         
         # Cria registro do exame
-        exam_data = {
-            'patient_id': patient_id,
-            'original_filename': file_info['original_filename'],
-            'file_path': file_info['file_path'],
-            'file_size': file_info['file_size'],
-            'file_type': file_info['file_type'],
-            'mime_type': file_info['mime_type'],
-            'processing_status': 'pending'
-        }
-        
-        # Adiciona informações opcionais do formulário
-        if 'exam_type' in request.form:
-            exam_data['exam_type'] = request.form['exam_type']
-        
-        if 'exam_date' in request.form and request.form['exam_date']:
-            try:
-                exam_data['exam_date'] = datetime.strptime(request.form['exam_date'], '%Y-%m-%d').date()
-            except:
-                pass
+        exam = _create_exam(patient_id, file_info, request.form)
+        db.session.flush()
+        
+        # Processamento em segundo plano: exame e job gravados na mesma transação
+        job = Job.enqueue('process_exam', exam_id=exam.id)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Exame enviado com sucesso. Processamento iniciado.',
+            'exam': exam.to_dict(),
+            'job': job.to_dict(),
+            'status_url': f'/api/jobs/{job.id}'
+        }), 202
+    
+    except RequestEntityTooLarge:
+        raise  # respondido pelo handler 413 do app
+    
+    except Exception as e:
+        db.session.rollback()
+        _discard_upload(file_info)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@exam_bp.route('/patients/<int:patient_id>/exams/batch', methods=['POST'])
+def upload_exams_batch(patient_id):
+    """Upload de vários exames numa única requisição (campo multipart ``files``).
+
+    Os exames e um job de processamento para cada um são gravados na mesma
+    transação, como no upload individual; a resposta traz o exame e o job de
+    cada arquivo (ou o motivo da recusa).
+    """
+    saved = []
+    try:
+        # Lote aceita corpo maior que o upload individual
+        request.max_content_length = BATCH_UPLOAD_MAX_CONTENT_LENGTH
         
-        if 'lab_name' in request.form:
-            exam_data['lab_name'] = request.form['lab_name']
+        patient = Patient.query.get(patient_id)
+        if not patient:
+            return jsonify({
+                'success': False,
+                'error': 'Paciente não encontrado'
+            }), 404
+        
+        files = [file for file in request.files.getlist('files') if file.filename]
+        if not files:
+            return jsonify({
+                'success': False,
+                'error': 'Nenhum arquivo enviado'
+            }), 400
         
-        if 'doctor_name' in request.form:
-            exam_data['doctor_name'] = request.form['doctor_name']
+        if len(files) > BATCH_UPLOAD_MAX_FILES:
+            return jsonify({
+                'success': False,
+                'error': f'Máximo de {BATCH_UPLOAD_MAX_FILES} arquivos por lote'
+            }), 400
         
-        exam = Exam(**exam_data)
-        db.session.add(exam)
+        # Recebe os arquivos; recusas (tipo/tamanho) não impedem os demais
+        results = []
+        for file in files:
+            try:
+                file_info = file_service.save_file(file, patient_id)
+            except ValueError as e:
+                results.append({'filename': file.filename, 'success': False, 'error': str(e)})
+                continue
+            saved.append(file_info)
+            results.append({'filename': file.filename, 'file_info': file_info})
+        
+        # Processamento em segundo plano: exames e jobs gravados na mesma transação
+        for result in results:
+            file_info = result.pop('file_info', None)
+            if file_info is not None:
+                exam = _create_exam(patient_id, file_info, request.form)
+                db.session.flush()
+                result['exam'] = exam
+                result['job'] = Job.enqueue('process_exam', exam_id=exam.id)
         db.session.commit()
         
-        # Processa imediatamente (síncrono) – mais simples e confiável no Render
-        _process_exam_now(exam)
+        for result in results:
+            if 'exam' in result:
+                result['success'] = True
+                result['exam'] = result['exam'].to_dict()
+                result['job'] = result['job'].to_dict()
         
         return jsonify({
             'success': True,
-            'message': 'Exame enviado com sucesso. Processamento iniciado.',
-            'exam': exam.to_dict()
-        }), 201
+            'message': f'{len(saved)} de {len(files)} exame(s) enviado(s). Processamento iniciado.',
+            'results': results
+        }), 202
+    
+    except RequestEntityTooLarge:
+        for file_info in saved:
+            file_service.discard_file(file_info)
+        raise  # respondido pelo handler 413 do app
     
     except Exception as e:
         db.session.rollback()
+        for file_info in saved:
+            _discard_upload(file_info)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def _batch_exams_response(raw_ids, raw_fields):
+    """Resposta comum dos lotes por id (GET ?ids= e POST /exams/batch)"""
+    try:
+        ids = Exam.parse_ids(raw_ids)
+        fields = Exam.parse_fields(raw_fields)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    exams, missing_ids = Exam.get_many(ids, fields)
+    return jsonify({
+        'success': True,
+        'exams': [exam.to_dict(fields) for exam in exams],
+        'missing_ids': missing_ids
+    })
+
+@exam_bp.route('/exams', methods=['GET'])
+def get_exams_batch():
+    """Retorna vários exames por id (?ids=1,2,3)"""
+    try:
+        return _batch_exams_response(request.args.get('ids', ''), request.args.get('fields'))
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@exam_bp.route('/exams/batch', methods=['POST'])
+def post_exams_batch():
+    """Retorna vários exames por id (corpo: {"ids": [...], "fields": "..."})"""
+    try:
+        data = request.get_json(silent=True) or {}
+        return _batch_exams_response(data.get('ids'), data.get('fields'))
+    
+    except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
@@ -186,7 +334,29 @@ def upload_exam(patient_id):
 def get_exam(exam_id):
     """Retorna dados completos de um exame"""
     try:
-        exam = Exam.query.get(exam_id)
+        try:
+            fields = Exam.parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # Só o timestamp (pela PK) decide entre 304 e carregar o registro
+        version = db.session.query(Exam.updated_at).filter(Exam.id == exam_id).first()
+        
+        if not version:
+            return jsonify({
+                'success': False,
+                'error': 'Exame não encontrado'
+            }), 404
+        
+        etag = make_etag('exam', exam_id, version.updated_at, request.query_string)
+        not_modified = not_modified_response(etag, version.updated_at)
+        if not_modified:
+            return not_modified
+        
+        exam = Exam.query.options(*Exam.load_options(fields or Exam.DETAIL_FIELDS)).filter_by(id=exam_id).first()
         
         if not exam:
             return jsonify({
@@ -194,10 +364,116 @@ def get_exam(exam_id):
                 'error': 'Exame não encontrado'
             }), 404
         
+        return with_validators(jsonify({
+            'success': True,
+            'exam': exam.to_dict(fields)
+        }), etag, version.updated_at)
+    
+    except Exception as e:
         return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@exam_bp.route('/exams/<int:exam_id>/pages', methods=['GET'])
+def get_exam_pages(exam_id):
+    """Texto extraído de uma faixa de páginas (?start=&end=, inclusive, a partir de 1)"""
+    try:
+        version = db.session.query(Exam.updated_at, Exam.page_count).filter(Exam.id == exam_id).first()
+        
+        if not version:
+            return jsonify({
+                'success': False,
+                'error': 'Exame não encontrado'
+            }), 404
+        
+        page_count = version.page_count or 0
+        try:
+            start = int(request.args.get('start', 1))
+            end = int(request.args.get('end', start + PAGES_PER_REQUEST - 1))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'start e end devem ser números inteiros'
+            }), 400
+        
+        if start < 1 or end < start:
+            return jsonify({
+                'success': False,
+                'error': 'Faixa de páginas inválida'
+            }), 400
+        end = min(end, start + PAGES_PER_REQUEST - 1)
+        
+        etag = make_etag('exam-pages', exam_id, version.updated_at, start, end)
+        not_modified = not_modified_response(etag, version.updated_at)
+        if not_modified:
+            return not_modified
+        
+        pages = ExamPage.get_range(exam_id, start, end)
+        
+        return with_validators(jsonify({
             'success': True,
-            'exam': exam.to_dict()
-        })
+            'exam_id': exam_id,
+            'page_count': page_count,
+            'start': start,
+            'end': min(end, page_count),
+            'pages': [page.to_dict() for page in pages]
+        }), etag, version.updated_at)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@exam_bp.route('/exams/<int:exam_id>/thumbnail', methods=['GET'])
+def get_exam_thumbnail(exam_id):
+    """Miniatura do exame (1ª página do PDF ou a imagem), servida do cache.
+
+    A miniatura é gerada pelo worker (no processamento do exame ou, se saiu
+    do cache, num job generate_preview): enquanto não existe, responde 202.
+    """
+    try:
+        exam = db.session.query(
+            Exam.file_hash, Exam.file_available, Exam.processing_status
+        ).filter(Exam.id == exam_id).first()
+        
+        if not exam:
+            return jsonify({
+                'success': False,
+                'error': 'Exame não encontrado'
+            }), 404
+        
+        preview_path = preview_service.get(exam.file_hash)
+        if not preview_path:
+            if not exam.file_hash or not exam.file_available or preview_service.is_unavailable(exam.file_hash):
+                return jsonify({
+                    'success': False,
+                    'error': 'Miniatura não disponível para este arquivo'
+                }), 404
+            
+            # O job de processamento pendente já gera a miniatura
+            job = None
+            if exam.processing_status not in ('pending', 'processing'):
+                job = Job.pending('generate_preview', exam_id=exam_id)
+                if job is None:
+                    job = Job.enqueue('generate_preview', exam_id=exam_id)
+                    db.session.commit()
+            
+            response = {
+                'success': True,
+                'message': 'Miniatura em geração, tente novamente em instantes'
+            }
+            if job is not None:
+                response['job'] = job.to_dict()
+                response['status_url'] = f'/api/jobs/{job.id}'
+            return jsonify(response), 202
+        
+        # O arquivo do exame não muda: a miniatura pode ficar no cache do navegador
+        response = send_file(os.path.abspath(preview_path), mimetype=preview_service.mimetype, conditional=True,
+                             etag=f'{exam.file_hash}-{preview_service.size}')
+        response.headers['Cache-Control'] = f'private, max-age={FILE_CACHE_MAX_AGE}, immutable'
+        return response
     
     except Exception as e:
         return jsonify({
@@ -220,27 +496,52 @@ def reprocess_exam(exam_id):
         # Reset status
         exam.processing_status = 'pending'
         exam.processing_error = None
-        exam.extracted_text = None
+        exam.clear_pages()
         exam.ai_analysis = None
         exam.extracted_values = None
         exam.ai_summary = None
         exam.processed_at = None
         exam.updated_at = datetime.utcnow()
         
+        # Processamento em segundo plano pela fila de jobs (sem reaproveitar resultados)
+        job = Job.enqueue('reprocess_exam', exam_id=exam.id)
         db.session.commit()
         
-        # Inicia processamento assíncrono
-        thread = threading.Thread(target=process_exam_async, args=(exam.id,))
-        thread.daemon = True
-        thread.start()
+        return jsonify({
+            'success': True,
+            'message': 'Reprocessamento iniciado',
+            'job': job.to_dict(),
+            'status_url': f'/api/jobs/{job.id}'
+        }), 202
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@exam_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Retorna o estado de um job de processamento"""
+    try:
+        job = db.session.get(Job, job_id)
+        
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': 'Job não encontrado'
+            }), 404
+        
+        exam = db.session.get(Exam, job.exam_id) if job.exam_id else None
         
         return jsonify({
             'success': True,
-            'message': 'Reprocessamento iniciado'
+            'job': job.to_dict(),
+            'exam': exam.to_summary_dict() if exam else None
         })
     
     except Exception as e:
-        db.session.rollback()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -258,14 +559,18 @@ def delete_exam(exam_id):
                 'error': 'Exame não encontrado'
             }), 404
         
-        # Remove arquivo do sistema
-        if exam.file_path and os.path.exists(exam.file_path):
-            file_service.delete_file(exam.file_path)
+        # Libera a referência ao arquivo (compartilhado entre exames com o mesmo conteúdo)
+        file_path = exam.file_path
+        file_unused = FileBlob.release(file_path) if file_path else False
         
         # Remove registro do banco
         db.session.delete(exam)
         db.session.commit()
         
+        # Só apaga o arquivo depois do commit e se nenhum upload voltou a usá-lo
+        if file_unused:
+            FileBlob.delete_file_if_unused(file_path, file_service.delete_file)
+        
         return jsonify({
             'success': True,
             'message': 'Exame removido com sucesso'
@@ -280,17 +585,50 @@ def delete_exam(exam_id):
 
 @exam_bp.route('/files/<path:filename>')
 def serve_file(filename):
-    """Serve arquivos de exames"""
+    """Serve arquivos de exames (Range, GET condicional e cache).
+
+    Blobs (uploads/blobs/...) têm conteúdo imutável: o ETag é o próprio
+    SHA-256 e o cache é longo. Com FILE_SERVING_MODE de proxy, a resposta só
+    indica o arquivo e o nginx/Apache entrega os bytes.
+    """
     try:
-        file_path = os.path.join(file_service.upload_folder, filename)
+        upload_root = os.path.abspath(file_service.upload_folder)
+        file_path = safe_join(upload_root, filename)
         
-        if not os.path.exists(file_path):
+        if not file_path or not os.path.isfile(file_path):
             return jsonify({
                 'success': False,
                 'error': 'Arquivo não encontrado'
             }), 404
         
-        return send_file(file_path)
+        relative_path = os.path.relpath(file_path, upload_root).replace(os.sep, '/')
+        stat = os.stat(file_path)
+        blob = BLOB_FILE_NAME.match(relative_path)
+        if blob:
+            etag = blob.group(1)
+            cache_control = f'private, max-age={FILE_CACHE_MAX_AGE}, immutable'
+        else:
+            # Arquivos antigos (fora de blobs): versão pelo tamanho e mtime
+            etag = make_etag('file', relative_path, stat.st_size, stat.st_mtime_ns)
+            cache_control = 'private, no-cache'
+        last_modified = datetime.utcfromtimestamp(stat.st_mtime)
+        
+        if FILE_SERVING_MODE in ('x-accel-redirect', 'x-sendfile'):
+            response = not_modified_response(etag, last_modified)
+            if response is None:
+                mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+                response = with_validators(current_app.response_class(mimetype=mimetype), etag, last_modified)
+                if FILE_SERVING_MODE == 'x-accel-redirect':
+                    response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(relative_path)
+                else:
+                    response.headers['X-Sendfile'] = file_path
+        else:
+            # send_file atende Range/If-Range/If-None-Match e entrega o arquivo
+            # via wsgi.file_wrapper (sendfile no gunicorn), sem ler em Python
+            response = send_file(file_path, conditional=True, etag=etag, last_modified=last_modified)
+        
+        response.headers['Cache-Control'] = cache_control
+        return response
     
     except Exception as e:
         return jsonify({
@@ -305,8 +643,9 @@ def get_exam_stats():
         # Estatísticas de processamento
         processing_stats = Exam.get_processing_stats()
         
-        # Estatísticas de armazenamento
-        storage_stats = file_service.get_storage_stats()
+        # Estatísticas de armazenamento (mantidas a cada upload/remoção)
+        storage_stats = StorageUsage.get_stats()
+        storage_stats['upload_folder'] = file_service.upload_folder
         
         # Exames recentes
         recent_exams = Exam.get_recent_exams(5)
@@ -333,6 +672,21 @@ def get_exam_stats():
             'error': str(e)
         }), 500
 
+@exam_bp.route('/ocr/stats', methods=['GET'])
+def get_ocr_stats():
+    """Estado do OCR neste processo: motor, vazão e percentis de latência"""
+    try:
+        return jsonify({
+            'success': True,
+            'ocr': ocr_service.get_stats()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @exam_bp.route('/ai/test', methods=['POST'])
 def test_ai_service():
     """Testa serviço de IA"""
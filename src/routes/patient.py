@@ -1,7 +1,15 @@
-from flask import Blueprint, request, jsonify
-from src.models.patient import Patient, db
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from src.models.patient import Patient, cpf_digits_of, db
+from src.routes.conditional import make_etag, not_modified_response, with_validators
+from src.services.patient_index import patient_name_index
 from datetime import datetime
+import csv
+import io
+import json
+import os
 import re
+import time
 
 patient_bp = Blueprint('patient', __name__)
 
@@ -27,32 +35,117 @@ def format_cpf(cpf):
         return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
     return cpf
 
+def _clean(value):
+    """Remove espaços de strings e converte vazios em None"""
+    if isinstance(value, str):
+        value = value.strip()
+    return value or None
+
+def _build_patient_data(data):
+    """Valida os dados de cadastro e retorna kwargs para Patient.
+
+    Levanta ValueError com a mensagem de erro quando algum campo é inválido.
+    Não verifica duplicidade de CPF (cabe ao chamador).
+    """
+    # Validações obrigatórias
+    required_fields = ['full_name', 'cpf', 'birth_date', 'gender']
+    for field in required_fields:
+        if not data.get(field):
+            raise ValueError(f'Campo obrigatório: {field}')
+    
+    # Valida CPF
+    cpf = str(data['cpf'])
+    if not validate_cpf(cpf):
+        raise ValueError('CPF inválido')
+    
+    # Converte data de nascimento
+    try:
+        birth_date = datetime.strptime(str(data['birth_date']).strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Data de nascimento inválida. Use o formato YYYY-MM-DD')
+    
+    return {
+        'full_name': str(data['full_name']).strip(),
+        'cpf': format_cpf(cpf),
+        'birth_date': birth_date,
+        'gender': data['gender'],
+        'phone': _clean(data.get('phone')),
+        'email': _clean(data.get('email')),
+        'address_street': _clean(data.get('address_street')),
+        'address_number': _clean(data.get('address_number')),
+        'address_complement': _clean(data.get('address_complement')),
+        'address_neighborhood': _clean(data.get('address_neighborhood')),
+        'address_city': _clean(data.get('address_city')),
+        'address_state': _clean(data.get('address_state')),
+        'address_zipcode': _clean(data.get('address_zipcode')),
+        'allergies': data.get('allergies', []),
+        'chronic_diseases': data.get('chronic_diseases', []),
+        'previous_surgeries': data.get('previous_surgeries', []),
+        'family_history': data.get('family_history', []),
+        'current_medications': data.get('current_medications', []),
+        'smoking': data.get('smoking') or 'never',
+        'alcohol_consumption': data.get('alcohol_consumption') or 'never',
+        'physical_activity': data.get('physical_activity') or 'sedentary'
+    }
+
+def _batch_patients_response(raw_ids, raw_fields):
+    """Resposta comum dos lotes por id (GET ?ids= e POST /patients/batch)"""
+    try:
+        ids = Patient.parse_ids(raw_ids)
+        fields = Patient.parse_fields(raw_fields)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    patients, missing_ids = Patient.get_many(ids, fields)
+    return jsonify({
+        'success': True,
+        'patients': [patient.to_dict(fields) for patient in patients],
+        'missing_ids': missing_ids
+    })
+
 @patient_bp.route('/patients', methods=['GET'])
 def get_patients():
-    """Lista todos os pacientes com opção de busca"""
+    """Lista todos os pacientes com opção de busca (ou um lote, com ?ids=1,2,3)"""
     try:
+        if 'ids' in request.args:
+            return _batch_patients_response(request.args.get('ids', ''), request.args.get('fields'))
+        
         query = request.args.get('search', '').strip()
         active_only = request.args.get('active_only', 'true').lower() == 'true'
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        include_total = request.args.get('include_total', 'true').lower() == 'true'
+        cursor = request.args.get('cursor') or None
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 20)), 1), 100)
         
-        # Busca pacientes
-        patients = Patient.search(query, active_only)
-        
-        # Paginação
-        total = len(patients)
-        start = (page - 1) * per_page
-        end = start + per_page
-        patients_page = patients[start:end]
+        # Busca pacientes (paginação feita no banco)
+        try:
+            fields = Patient.parse_fields(request.args.get('fields'))
+            # full_name entra sempre: é a chave do cursor
+            options = Patient.load_options(fields + ['full_name']) if fields else None
+            patients, total, next_cursor = Patient.search(
+                query, active_only,
+                page=page, per_page=per_page,
+                cursor=cursor, with_total=include_total,
+                options=options
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
         return jsonify({
             'success': True,
-            'patients': [patient.to_summary_dict() for patient in patients_page],
+            'patients': [patient.serialize(fields) if fields else patient.to_summary_dict() for patient in patients],
             'pagination': {
-                'page': page,
+                'page': None if cursor else page,
                 'per_page': per_page,
                 'total': total,
-                'pages': (total + per_page - 1) // per_page
+                'pages': (total + per_page - 1) // per_page if total is not None else None,
+                'next_cursor': next_cursor
             }
         })
     
@@ -62,11 +155,51 @@ def get_patients():
             'error': str(e)
         }), 500
 
+@patient_bp.route('/patients/autocomplete', methods=['GET'])
+def autocomplete_patients():
+    """Sugestões de pacientes ativos por prefixo do nome (índice em memória)"""
+    try:
+        query = request.args.get('q', '').strip()
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+        
+        return jsonify({
+            'success': True,
+            'patients': patient_name_index.search(query, limit) if query else []
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @patient_bp.route('/patients/<int:patient_id>', methods=['GET'])
 def get_patient(patient_id):
     """Retorna dados completos de um paciente"""
     try:
-        patient = Patient.query.get(patient_id)
+        try:
+            fields = Patient.parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # Só o timestamp (pela PK) decide entre 304 e carregar o registro
+        version = db.session.query(Patient.updated_at).filter(Patient.id == patient_id).first()
+        
+        if not version:
+            return jsonify({
+                'success': False,
+                'error': 'Paciente não encontrado'
+            }), 404
+        
+        etag = make_etag('patient', patient_id, version.updated_at, request.query_string)
+        not_modified = not_modified_response(etag, version.updated_at)
+        if not_modified:
+            return not_modified
+        
+        patient = Patient.query.options(*Patient.load_options(fields)).filter_by(id=patient_id).first()
         
         if not patient:
             return jsonify({
@@ -74,10 +207,23 @@ def get_patient(patient_id):
                 'error': 'Paciente não encontrado'
             }), 404
         
-        return jsonify({
+        return with_validators(jsonify({
             'success': True,
-            'patient': patient.to_dict()
-        })
+            'patient': patient.to_dict(fields)
+        }), etag, version.updated_at)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@patient_bp.route('/patients/batch', methods=['POST'])
+def get_patients_batch():
+    """Retorna vários pacientes por id (corpo: {"ids": [...], "fields": "..."})"""
+    try:
+        data = request.get_json(silent=True) or {}
+        return _batch_patients_response(data.get('ids'), data.get('fields'))
     
     except Exception as e:
         return jsonify({
@@ -97,77 +243,193 @@ def create_patient():
                 'error': 'Dados não fornecidos'
             }), 400
         
-        # Validações obrigatórias
-        required_fields = ['full_name', 'cpf', 'birth_date', 'gender']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({
-                    'success': False,
-                    'error': f'Campo obrigatório: {field}'
-                }), 400
-        
-        # Valida CPF
-        cpf = data['cpf']
-        if not validate_cpf(cpf):
+        try:
+            patient_data = _build_patient_data(data)
+        except ValueError as e:
             return jsonify({
                 'success': False,
-                'error': 'CPF inválido'
+                'error': str(e)
             }), 400
         
-        # Formata CPF
-        formatted_cpf = format_cpf(cpf)
-        
-        # Verifica se CPF já existe
-        existing_patient = Patient.query.filter_by(cpf=formatted_cpf).first()
+        # Verifica se CPF já existe (igualdade na coluna indexada)
+        existing_patient = db.session.query(Patient.id).filter(
+            Patient.cpf_digits == cpf_digits_of(patient_data['cpf'])
+        ).first()
         if existing_patient:
             return jsonify({
                 'success': False,
                 'error': 'CPF já cadastrado'
             }), 400
         
-        # Converte data de nascimento
+        patient = Patient(**patient_data)
+        db.session.add(patient)
+        db.session.commit()
+        patient_name_index.sync(patient, created=True)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Paciente cadastrado com sucesso',
+            'patient': patient.to_dict()
+        }), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# Importação em lote
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_CONTENT_LENGTH = int(os.environ.get('IMPORT_MAX_CONTENT_LENGTH', 500 * 1024 * 1024))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+IMPORT_LIST_FIELDS = ['allergies', 'chronic_diseases', 'previous_surgeries', 'family_history', 'current_medications']
+
+def _iter_import_rows(stream, file_format):
+    """Lê o upload linha a linha, gerando (linha, dados, erro)"""
+    lines = (raw_line.decode('utf-8-sig') for raw_line in stream)
+    
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Listas médicas no CSV são separadas por '|'
+            for field in IMPORT_LIST_FIELDS:
+                if row.get(field):
+                    row[field] = [item.strip() for item in row[field].split('|') if item.strip()]
+                else:
+                    row.pop(field, None)
+            yield reader.line_num, row, None
+        return
+    
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
         try:
-            birth_date = datetime.strptime(data['birth_date'], '%Y-%m-%d').date()
+            row = json.loads(line)
         except ValueError:
+            yield line_no, None, 'JSON inválido'
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, 'Cada linha deve ser um objeto JSON'
+            continue
+        yield line_no, row, None
+
+def _import_batch(batch):
+    """Insere um lote numa transação; retorna (importados, erros)"""
+    errors = []
+    
+    # Uma única consulta IN para os CPFs do lote
+    batch_digits = [cpf_digits_of(data['cpf']) for _, data in batch]
+    existing = {
+        row[0] for row in db.session.query(Patient.cpf_digits).filter(
+            Patient.cpf_digits.in_(batch_digits)
+        )
+    }
+    
+    patients = []
+    for line_no, data in batch:
+        digits = cpf_digits_of(data['cpf'])
+        if digits in existing:
+            errors.append({'line': line_no, 'error': 'CPF já cadastrado'})
+            continue
+        existing.add(digits)  # duplicados dentro do próprio lote
+        patients.append(Patient(**data))
+    
+    try:
+        db.session.add_all(patients)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        failed_lines = [line_no for line_no, _ in batch if not any(err['line'] == line_no for err in errors)]
+        errors.extend({'line': line_no, 'error': f'Erro ao gravar lote: {str(e)}'} for line_no in failed_lines)
+        return 0, errors
+    
+    for patient in patients:
+        patient_name_index.sync(patient, created=True)
+    return len(patients), errors
+
+@patient_bp.route('/patients/import', methods=['POST'])
+def import_patients():
+    """Importa pacientes em lote a partir de CSV ou NDJSON"""
+    try:
+        started = time.perf_counter()
+        # Planilhas de cadastro podem passar do limite global de upload
+        request.max_content_length = IMPORT_MAX_CONTENT_LENGTH
+        
+        # Arquivo via multipart ('file') ou corpo bruto da requisição
+        upload = request.files.get('file')
+        stream = upload.stream if upload else request.stream
+        filename = (upload.filename or '') if upload else ''
+        content_type = (upload.mimetype if upload else request.mimetype) or ''
+        
+        file_format = request.args.get('format', '').lower()
+        if not file_format:
+            if filename.lower().endswith('.csv') or 'csv' in content_type:
+                file_format = 'csv'
+            else:
+                file_format = 'ndjson'
+        if file_format not in ('csv', 'ndjson'):
             return jsonify({
                 'success': False,
-                'error': 'Data de nascimento inválida. Use o formato YYYY-MM-DD'
+                'error': 'Formato não suportado. Use csv ou ndjson'
             }), 400
         
-        # Cria novo paciente
-        patient_data = {
-            'full_name': data['full_name'].strip(),
-            'cpf': formatted_cpf,
-            'birth_date': birth_date,
-            'gender': data['gender'],
-            'phone': data.get('phone', '').strip() or None,
-            'email': data.get('email', '').strip() or None,
-            'address_street': data.get('address_street', '').strip() or None,
-            'address_number': data.get('address_number', '').strip() or None,
-            'address_complement': data.get('address_complement', '').strip() or None,
-            'address_neighborhood': data.get('address_neighborhood', '').strip() or None,
-            'address_city': data.get('address_city', '').strip() or None,
-            'address_state': data.get('address_state', '').strip() or None,
-            'address_zipcode': data.get('address_zipcode', '').strip() or None,
-            'allergies': data.get('allergies', []),
-            'chronic_diseases': data.get('chronic_diseases', []),
-            'previous_surgeries': data.get('previous_surgeries', []),
-            'family_history': data.get('family_history', []),
-            'current_medications': data.get('current_medications', []),
-            'smoking': data.get('smoking', 'never'),
-            'alcohol_consumption': data.get('alcohol_consumption', 'never'),
-            'physical_activity': data.get('physical_activity', 'sedentary')
-        }
+        batch_size = min(max(int(request.args.get('batch_size', IMPORT_BATCH_SIZE)), 1), 5000)
+        
+        total_rows = 0
+        imported = 0
+        failed = 0
+        errors = []
+        batch = []
+        
+        def report(batch_errors):
+            remaining = IMPORT_MAX_REPORTED_ERRORS - len(errors)
+            if remaining > 0:
+                errors.extend(batch_errors[:remaining])
+        
+        for line_no, data, error in _iter_import_rows(stream, file_format):
+            total_rows += 1
+            if error is None:
+                try:
+                    batch.append((line_no, _build_patient_data(data)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                failed += 1
+                report([{'line': line_no, 'error': error}])
+            
+            if len(batch) >= batch_size:
+                batch_imported, batch_errors = _import_batch(batch)
+                imported += batch_imported
+                failed += len(batch_errors)
+                report(batch_errors)
+                batch = []
         
-        patient = Patient(**patient_data)
-        db.session.add(patient)
-        db.session.commit()
+        if batch:
+            batch_imported, batch_errors = _import_batch(batch)
+            imported += batch_imported
+            failed += len(batch_errors)
+            report(batch_errors)
+        
+        elapsed = time.perf_counter() - started
         
         return jsonify({
             'success': True,
-            'message': 'Paciente cadastrado com sucesso',
-            'patient': patient.to_dict()
-        }), 201
+            'message': f'{imported} paciente(s) importado(s)',
+            'import': {
+                'format': file_format,
+                'total_rows': total_rows,
+                'imported': imported,
+                'failed': failed,
+                'errors': errors,
+                'errors_truncated': failed > len(errors),
+                'elapsed_seconds': round(elapsed, 3),
+                'rows_per_second': round(total_rows / elapsed, 1) if elapsed > 0 else None
+            }
+        })
+    
+    except RequestEntityTooLarge:
+        raise  # respondido pelo handler 413 do app
     
     except Exception as e:
         db.session.rollback()
@@ -176,6 +438,101 @@ def create_patient():
             'error': str(e)
         }), 500
 
+# Exportação
+EXPORT_CHUNK_ROWS = 500
+# Blocos achatados sem prefixo, para que as colunas coincidam com as da importação
+EXPORT_UNPREFIXED_GROUPS = ('medical_info', 'lifestyle')
+
+def _flatten_for_csv(data, prefix=''):
+    """Achata dicionários aninhados (address_street...) e listas ('a|b') para CSV"""
+    flat = {}
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            group_prefix = '' if key in EXPORT_UNPREFIXED_GROUPS else f'{name}_'
+            flat.update(_flatten_for_csv(value, group_prefix))
+        elif isinstance(value, list):
+            flat[name] = '|'.join(str(item) for item in value)
+        else:
+            flat[name] = value
+    return flat
+
+@patient_bp.route('/patients/export', methods=['GET'])
+def export_patients():
+    """Exporta pacientes em NDJSON ou CSV com resposta em streaming"""
+    try:
+        file_format = request.args.get('format', 'ndjson').lower()
+        detail = request.args.get('detail', 'summary').lower()
+        active_only = request.args.get('active_only', 'true').lower() == 'true'
+        
+        if file_format not in ('csv', 'ndjson'):
+            return jsonify({
+                'success': False,
+                'error': 'Formato não suportado. Use csv ou ndjson'
+            }), 400
+        
+        if detail not in ('summary', 'full'):
+            return jsonify({
+                'success': False,
+                'error': 'Detalhe inválido. Use summary ou full'
+            }), 400
+        
+        query = Patient.query
+        if active_only:
+            query = query.filter(Patient.active == True)
+        
+        # yield_per usa cursor no servidor (stream_results) e hidrata em blocos:
+        # a memória não cresce com o tamanho do cadastro
+        query = query.order_by(Patient.id).yield_per(EXPORT_CHUNK_ROWS)
+        
+        def serialize(patient):
+            return patient.to_dict() if detail == 'full' else patient.to_summary_dict()
+        
+        def generate_ndjson():
+            chunk = []
+            for patient in query:
+                chunk.append(json.dumps(serialize(patient), ensure_ascii=False))
+                if len(chunk) >= EXPORT_CHUNK_ROWS:
+                    yield '\n'.join(chunk) + '\n'
+                    chunk = []
+            if chunk:
+                yield '\n'.join(chunk) + '\n'
+        
+        def generate_csv():
+            buffer = io.StringIO()
+            writer = None
+            rows = 0
+            for patient in query:
+                row = _flatten_for_csv(serialize(patient))
+                if writer is None:
+                    writer = csv.DictWriter(buffer, fieldnames=list(row.keys()))
+                    writer.writeheader()
+                writer.writerow(row)
+                rows += 1
+                if rows % EXPORT_CHUNK_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        
+        if file_format == 'csv':
+            generator, mimetype = generate_csv(), 'text/csv'
+        else:
+            generator, mimetype = generate_ndjson(), 'application/x-ndjson'
+        
+        return Response(
+            stream_with_context(generator),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename=patients.{file_format}'}
+        )
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @patient_bp.route('/patients/<int:patient_id>', methods=['PUT'])
 def update_patient(patient_id):
     """Atualiza dados de um paciente"""
@@ -211,8 +568,8 @@ def update_patient(patient_id):
             formatted_cpf = format_cpf(cpf)
             
             # Verifica se CPF já existe (exceto o próprio paciente)
-            existing_patient = Patient.query.filter(
-                Patient.cpf == formatted_cpf,
+            existing_patient = db.session.query(Patient.id).filter(
+                Patient.cpf_digits == cpf_digits_of(cpf),
                 Patient.id != patient_id
             ).first()
             
@@ -267,6 +624,7 @@ def update_patient(patient_id):
         
         patient.updated_at = datetime.utcnow()
         db.session.commit()
+        patient_name_index.sync(patient)
         
         return jsonify({
             'success': True,
@@ -296,6 +654,7 @@ def delete_patient(patient_id):
         patient.active = False
         patient.updated_at = datetime.utcnow()
         db.session.commit()
+        patient_name_index.remove(patient_id, patient.updated_at)
         
         return jsonify({
             'success': True,
@@ -324,6 +683,7 @@ def activate_patient(patient_id):
         patient.active = True
         patient.updated_at = datetime.utcnow()
         db.session.commit()
+        patient_name_index.sync(patient)
         
         return jsonify({
             'success': True,
@@ -1,16 +1,53 @@
 from flask import Blueprint, request, jsonify
+from src.models import db
 from src.models.patient import Patient
 from src.models.exam import Exam
+from src.models.exam_counters import StorageUsage
+from src.routes.conditional import make_etag, not_modified_response, with_validators
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import undefer
 import json
 
 reports_bp = Blueprint('reports', __name__)
 
+def _patient_report_etag(patient_id):
+    """ETag dos relatórios do paciente, obtido numa única consulta.
+
+    Combina a versão do paciente, o último exame alterado e o número de exames
+    (que muda em exclusões), além de rota, filtros e data (janelas "últimos N
+    dias"). Retorna None se o paciente não existe.
+    """
+    last_exam_update = db.select(func.max(Exam.updated_at)).where(
+        Exam.patient_id == Patient.id
+    ).scalar_subquery()
+    exam_count = db.select(func.count(Exam.id)).where(
+        Exam.patient_id == Patient.id
+    ).scalar_subquery()
+    
+    version = db.session.query(Patient.updated_at, last_exam_update, exam_count).filter(
+        Patient.id == patient_id
+    ).first()
+    if version is None:
+        return None
+    return make_etag(request.path, request.query_string, datetime.utcnow().date(), *version)
+
 @reports_bp.route('/patients/<int:patient_id>/medical-record', methods=['GET'])
 def get_patient_medical_record(patient_id):
     """Retorna prontuário completo do paciente"""
     try:
+        # Responde 304 sem carregar nada se o cliente já tem esta versão
+        etag = _patient_report_etag(patient_id)
+        if etag is None:
+            return jsonify({
+                'success': False,
+                'error': 'Paciente não encontrado'
+            }), 404
+        
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+        
         # Verifica se paciente existe
         patient = Patient.query.get(patient_id)
         if not patient:
@@ -25,7 +62,7 @@ def get_patient_medical_record(patient_id):
         exam_type = request.args.get('exam_type')
         
         # Query base para exames
-        exams_query = Exam.query.filter_by(patient_id=patient_id)
+        exams_query = Exam.query.filter_by(patient_id=patient_id).options(*Exam.load_options(Exam.DETAIL_FIELDS))
         
         # Filtros opcionais
         if start_date:
@@ -59,7 +96,7 @@ def get_patient_medical_record(patient_id):
         # Laboratórios únicos
         labs = list(set([e.lab_name for e in exams if e.lab_name]))
         
-        return jsonify({
+        return with_validators(jsonify({
             'success': True,
             'patient': patient.to_dict(),
             'exams': [exam.to_dict() for exam in exams],
@@ -71,7 +108,7 @@ def get_patient_medical_record(patient_id):
                 'exam_types': exam_types,
                 'labs': labs
             }
-        })
+        }), etag)
     
     except Exception as e:
         return jsonify({
@@ -83,6 +120,18 @@ def get_patient_medical_record(patient_id):
 def get_patient_timeline(patient_id):
     """Retorna timeline de eventos do paciente"""
     try:
+        # Responde 304 sem carregar nada se o cliente já tem esta versão
+        etag = _patient_report_etag(patient_id)
+        if etag is None:
+            return jsonify({
+                'success': False,
+                'error': 'Paciente não encontrado'
+            }), 404
+        
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+        
         # Verifica se paciente existe
         patient = Patient.query.get(patient_id)
         if not patient:
@@ -120,17 +169,17 @@ def get_patient_timeline(patient_id):
                 'icon': 'file-text',
                 'color': 'green' if exam.processing_status == 'completed' else 'yellow' if exam.processing_status == 'pending' else 'red',
                 'exam_id': exam.id,
-                'has_results': bool(exam.ai_summary or exam.extracted_values)
+                'has_results': bool(exam.has_results)
             })
         
         # Ordena por data (mais recente primeiro)
         timeline.sort(key=lambda x: x['date'] or '', reverse=True)
         
-        return jsonify({
+        return with_validators(jsonify({
             'success': True,
             'patient': patient.to_summary_dict(),
             'timeline': timeline
-        })
+        }), etag)
     
     except Exception as e:
         return jsonify({
@@ -142,6 +191,18 @@ def get_patient_timeline(patient_id):
 def get_patient_trends(patient_id):
     """Retorna dados para gráficos de tendências"""
     try:
+        # Responde 304 sem carregar nada se o cliente já tem esta versão
+        etag = _patient_report_etag(patient_id)
+        if etag is None:
+            return jsonify({
+                'success': False,
+                'error': 'Paciente não encontrado'
+            }), 404
+        
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+        
         # Verifica se paciente existe
         patient = Patient.query.get(patient_id)
         if not patient:
@@ -165,7 +226,7 @@ def get_patient_trends(patient_id):
                 Exam.extracted_values.isnot(None),
                 Exam.created_at >= start_date
             )
-        ).order_by(Exam.exam_date.asc(), Exam.created_at.asc()).all()
+        ).options(undefer(Exam.extracted_values)).order_by(Exam.exam_date.asc(), Exam.created_at.asc()).all()
         
         # Extrai dados para gráficos
         trends_data = []
@@ -244,22 +305,22 @@ def get_patient_trends(patient_id):
                 if param_data:
                     trends_by_param[param_name] = sorted(param_data, key=lambda x: x['date'])
             
-            return jsonify({
+            return with_validators(jsonify({
                 'success': True,
                 'patient': patient.to_summary_dict(),
                 'trends_by_parameter': trends_by_param,
                 'available_parameters': parameter_values,
                 'period_months': months
-            })
+            }), etag)
         
-        return jsonify({
+        return with_validators(jsonify({
             'success': True,
             'patient': patient.to_summary_dict(),
             'trends_data': sorted(trends_data, key=lambda x: x['date']),
             'available_parameters': parameter_values,
             'selected_parameter': parameter,
             'period_months': months
-        })
+        }), etag)
     
     except Exception as e:
         return jsonify({
@@ -271,6 +332,18 @@ def get_patient_trends(patient_id):
 def get_patient_summary(patient_id):
     """Retorna resumo executivo do paciente"""
     try:
+        # Responde 304 sem carregar nada se o cliente já tem esta versão
+        etag = _patient_report_etag(patient_id)
+        if etag is None:
+            return jsonify({
+                'success': False,
+                'error': 'Paciente não encontrado'
+            }), 404
+        
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+        
         # Verifica se paciente existe
         patient = Patient.query.get(patient_id)
         if not patient:
@@ -279,11 +352,12 @@ def get_patient_summary(patient_id):
                 'error': 'Paciente não encontrado'
             }), 404
         
-        # Estatísticas de exames
-        total_exams = Exam.query.filter_by(patient_id=patient_id).count()
-        completed_exams = Exam.query.filter_by(patient_id=patient_id, processing_status='completed').count()
-        pending_exams = Exam.query.filter_by(patient_id=patient_id, processing_status='pending').count()
-        error_exams = Exam.query.filter_by(patient_id=patient_id, processing_status='error').count()
+        # Estatísticas de exames (contadores mantidos por status)
+        exam_stats = Exam.get_processing_stats(patient_id)
+        total_exams = exam_stats['total']
+        completed_exams = exam_stats['completed']
+        pending_exams = exam_stats['pending']
+        error_exams = exam_stats['error']
         
         # Exames recentes (últimos 30 dias)
         recent_date = datetime.utcnow() - timedelta(days=30)
@@ -313,7 +387,7 @@ def get_patient_summary(patient_id):
                 Exam.processing_status == 'completed',
                 Exam.created_at >= recent_date
             )
-        ).order_by(Exam.created_at.desc()).limit(5).all()
+        ).options(undefer(Exam.ai_analysis)).order_by(Exam.created_at.desc()).limit(5).all()
         
         for exam in recent_completed_exams:
             try:
@@ -332,7 +406,7 @@ def get_patient_summary(patient_id):
             except:
                 continue
         
-        return jsonify({
+        return with_validators(jsonify({
             'success': True,
             'patient': patient.to_dict(),
             'summary': {
@@ -344,6 +418,7 @@ def get_patient_summary(patient_id):
                     'recent': recent_exams,
                     'completion_rate': round((completed_exams / total_exams * 100) if total_exams > 0 else 0, 1)
                 },
+                'storage': StorageUsage.get_stats(patient_id),
                 'last_exam': last_exam.to_summary_dict() if last_exam else None,
                 'exam_types': exam_types,
                 'laboratories': labs,
@@ -355,7 +430,7 @@ def get_patient_summary(patient_id):
                     'altered_values': len(altered_values) > 0
                 }
             }
-        })
+        }), etag)
     
     except Exception as e:
         return jsonify({
@@ -369,39 +444,37 @@ def get_dashboard_stats():
     try:
         # Estatísticas de pacientes
         total_patients = Patient.query.count()
-        active_patients = Patient.query.filter_by(is_active=True).count()
+        active_patients = Patient.query.filter_by(active=True).count()
         
-        # Estatísticas de exames
-        total_exams = Exam.query.count()
-        completed_exams = Exam.query.filter_by(processing_status='completed').count()
-        pending_exams = Exam.query.filter_by(processing_status='pending').count()
-        error_exams = Exam.query.filter_by(processing_status='error').count()
+        # Estatísticas de exames (contadores mantidos por status)
+        exam_stats = Exam.get_processing_stats()
+        total_exams = exam_stats['total']
+        completed_exams = exam_stats['completed']
+        pending_exams = exam_stats['pending']
+        error_exams = exam_stats['error']
         
         # Exames recentes (últimos 7 dias)
         recent_date = datetime.utcnow() - timedelta(days=7)
         recent_exams = Exam.query.filter(Exam.created_at >= recent_date).count()
         
-        # Exames por dia (últimos 30 dias)
+        # Exames por dia (últimos 30 dias), numa única consulta agrupada
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        first_day = today - timedelta(days=29)
+        created_day = func.date(Exam.created_at)
+        counts_by_day = {
+            str(day): count for day, count in db.session.query(created_day, func.count(Exam.id))
+            .filter(Exam.created_at >= first_day)
+            .group_by(created_day).all()
+        }
+        
         exams_by_day = []
         for i in range(30):
-            day = datetime.utcnow() - timedelta(days=i)
-            day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = day_start + timedelta(days=1)
-            
-            count = Exam.query.filter(
-                and_(
-                    Exam.created_at >= day_start,
-                    Exam.created_at < day_end
-                )
-            ).count()
-            
+            day = (first_day + timedelta(days=i)).date().isoformat()
             exams_by_day.append({
-                'date': day.date().isoformat(),
-                'count': count
+                'date': day,
+                'count': counts_by_day.get(day, 0)
             })
         
-        exams_by_day.reverse()  # Ordem cronológica
-        
         return jsonify({
             'success': True,
             'stats': {
@@ -10,6 +10,10 @@ class AIService:
         """Define a chave da API"""
         self.api_key = api_key
     
+    def is_available(self):
+        """Indica se há chave de API configurada (a análise por regex funciona sem ela)"""
+        return bool(self.api_key)
+    
     def analyze_exam_text(self, text, exam_type=None):
         """Analisa texto do exame usando regex (fallback sem IA)"""
         try:
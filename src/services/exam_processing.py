@@ -0,0 +1,188 @@
+import os
+from datetime import datetime
+from src.models import db
+from src.models.exam import Exam
+from src.models.exam_counters import ExamStatusCounter, StorageUsage
+from src.models.file_blob import FileBlob
+from src.services.file_service_simple import FileService
+from src.services.job_queue import register_handler, register_periodic
+from src.services.preview_service import preview_service
+
+file_service = FileService(upload_folder='uploads')
+
+# Conferência periódica de presença dos arquivos em disco (0 desativa)
+FILE_RECONCILE_INTERVAL = int(os.environ.get('FILE_RECONCILE_INTERVAL', 3600))
+FILE_RECONCILE_BATCH_SIZE = 500
+
+# Recontagem periódica dos contadores de status (corrige desvios; 0 desativa)
+EXAM_COUNTERS_REBUILD_INTERVAL = int(os.environ.get('EXAM_COUNTERS_REBUILD_INTERVAL', 24 * 3600))
+
+# Recálculo periódico do uso de armazenamento (corrige desvios; 0 desativa)
+STORAGE_RECONCILE_INTERVAL = int(os.environ.get('STORAGE_RECONCILE_INTERVAL', 24 * 3600))
+
+
+def _find_donor(exam):
+    """Outro exame já processado com o mesmo conteúdo (mesmo SHA-256), se houver"""
+    if not exam.file_hash:
+        return None
+    return Exam.query.filter(
+        Exam.file_hash == exam.file_hash,
+        Exam.id != exam.id,
+        Exam.processing_status == 'completed'
+    ).order_by(Exam.processed_at.desc()).first()
+
+
+def apply_donor_results(exam, donor):
+    """Copia os resultados de um exame já processado com o mesmo arquivo"""
+    exam.set_pages([page.text for page in donor.pages])
+    exam.extracted_values = donor.get_extracted_values()
+    exam.ai_analysis = donor.get_ai_analysis()
+    exam.ai_summary = donor.ai_summary
+    exam.processing_status = "completed"
+    exam.processing_error = None
+    exam.processed_at = datetime.utcnow()
+
+
+def apply_extraction(exam, pages, err):
+    """Grava no exame o resultado de extract_pages_from_file (sem commit)"""
+    exam.processed_at = datetime.utcnow()
+    if err:
+        exam.processing_status = "error"
+        exam.processing_error = err
+        return
+
+    # Campos básicos (ajuste se o seu AIService tiver métodos reais)
+    exam.set_pages(pages or [])
+    text = exam.extracted_text
+    exam.extracted_values = {}   # implementar parsing depois, se quiser
+    exam.ai_analysis = {}        # idem
+    exam.ai_summary = "Resumo automático: texto extraído disponível." if text else "Sem texto extraído."
+    exam.processing_status = "completed"
+    exam.processing_error = None
+
+
+def generate_preview(file_path, file_type, file_hash):
+    """Gera a miniatura do arquivo (se ainda não está em cache); falhas não afetam o processamento"""
+    try:
+        preview_service.get_or_create(file_path, file_type, file_hash)
+    except Exception as e:
+        print(f"Falha ao gerar miniatura de {file_path}: {e}")
+
+
+@register_handler('process_exam')
+def process_exam(job, reuse_results=True):
+    """
+    Processa o exame do job:
+    - Reaproveita os resultados de um exame já processado com o mesmo arquivo
+      (sem nova extração), quando existir
+    - Caso contrário, extrai texto do arquivo (PDF/Imagem) usando FileService (versão 'simple')
+    - Atualiza status e timestamps
+    - Preenche campos básicos (summary/análise placeholders)
+    - Gera a miniatura do arquivo (cache por hash)
+    Exceções inesperadas marcam o exame com erro e sobem para o worker,
+    que reagenda o job com backoff.
+    """
+    exam = db.session.get(Exam, job.exam_id)
+    if exam is None:
+        return  # exame removido antes do processamento
+
+    try:
+        donor = _find_donor(exam) if reuse_results else None
+        generate_preview(exam.file_path, exam.file_type, exam.file_hash)
+
+        if donor is not None:
+            apply_donor_results(exam, donor)
+            db.session.commit()
+            return
+
+        exam.processing_status = "processing"
+        db.session.commit()
+
+        # Cancelado pelo worker no desligamento ou quando o job passa do tempo
+        cancel_event = getattr(job, 'cancel_event', None)
+        pages, err = file_service.extract_pages_from_file(exam.file_path, exam.file_type, cancel_event)
+        apply_extraction(exam, pages, err)
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        exam = db.session.get(Exam, job.exam_id)
+        if exam is not None:
+            exam.processing_status = "error"
+            exam.processing_error = str(e)
+            exam.processed_at = datetime.utcnow()
+            db.session.commit()
+        raise
+
+
+@register_handler('reprocess_exam')
+def reprocess_exam(job):
+    """Reprocessamento pedido pelo usuário: sempre extrai de novo"""
+    process_exam(job, reuse_results=False)
+
+
+@register_handler('generate_preview')
+def generate_exam_preview(job):
+    """Miniatura pedida em GET /exams/<id>/thumbnail quando não estava no cache"""
+    exam = db.session.get(Exam, job.exam_id)
+    if exam is not None:
+        generate_preview(exam.file_path, exam.file_type, exam.file_hash)
+
+
+@register_handler('reconcile_exam_files')
+def reconcile_exam_files(job):
+    """Atualiza file_available conferindo no disco, em lotes, o arquivo de cada exame.
+
+    Também apaga blobs que ficaram sem referência quando a remoção de um
+    exame foi interrompida entre o commit e FileBlob.delete_file_if_unused.
+    """
+    for file_path in FileBlob.unused_paths():
+        FileBlob.delete_file_if_unused(file_path, file_service.delete_file)
+
+    last_id = 0
+    while True:
+        rows = db.session.query(Exam.id, Exam.file_path, Exam.file_available).filter(
+            Exam.id > last_id
+        ).order_by(Exam.id).limit(FILE_RECONCILE_BATCH_SIZE).all()
+        if not rows:
+            break
+
+        present = {}  # arquivo -> existe (blobs são compartilhados entre exames)
+        changes = []
+        now = datetime.utcnow()
+        for row in rows:
+            if row.file_path not in present:
+                present[row.file_path] = bool(row.file_path) and os.path.exists(row.file_path)
+            if present[row.file_path] != row.file_available:
+                changes.append({'id': row.id, 'file_available': present[row.file_path], 'updated_at': now})
+
+        if changes:
+            db.session.execute(db.update(Exam), changes)
+        db.session.commit()
+        last_id = rows[-1].id
+
+
+if FILE_RECONCILE_INTERVAL > 0:
+    register_periodic('reconcile_exam_files', FILE_RECONCILE_INTERVAL)
+
+
+@register_handler('rebuild_exam_status_counters')
+def rebuild_exam_status_counters(job):
+    """Recalcula exam_status_counters a partir da tabela exams"""
+    ExamStatusCounter.rebuild(db.session.connection())
+    db.session.commit()
+
+
+if EXAM_COUNTERS_REBUILD_INTERVAL > 0:
+    register_periodic('rebuild_exam_status_counters', EXAM_COUNTERS_REBUILD_INTERVAL)
+
+
+@register_handler('reconcile_storage_usage')
+def reconcile_storage_usage(job):
+    """Recalcula storage_usage a partir dos tamanhos registrados nos exames e em file_blobs"""
+    StorageUsage.rebuild(db.session.connection())
+    db.session.commit()
+
+
+if STORAGE_RECONCILE_INTERVAL > 0:
+    register_periodic('reconcile_storage_usage', STORAGE_RECONCILE_INTERVAL)
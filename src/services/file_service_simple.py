@@ -1,65 +1,148 @@
+import hashlib
 import os
-import uuid
+import tempfile
 from werkzeug.utils import secure_filename
+from src.services.ocr_service import OCRCancelled, OCRError, OCRUnavailable, ocr_service
+from src.services.pdf_extraction import extract_pdf_pages
+
+CHUNK_SIZE = 64 * 1024  # bytes lidos/gravados por vez no upload
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 20 * 1024 * 1024))
 
 class FileService:
-    def __init__(self, upload_folder="uploads"):
+    def __init__(self, upload_folder="uploads", max_file_size=MAX_UPLOAD_SIZE):
         self.upload_folder = upload_folder
         self.allowed_extensions = {"pdf", "png", "jpg", "jpeg"}
+        self.max_file_size = max_file_size
 
     def allowed_file(self, filename):
         return "." in filename and filename.rsplit(".", 1)[1].lower() in self.allowed_extensions
 
     def save_file(self, file, patient_id):
-        """Salva arquivo no sistema e retorna metadados compatíveis com exam.py"""
+        """Recebe o arquivo numa área temporária e retorna metadados compatíveis com exam.py.
+
+        O arquivo é armazenado pelo conteúdo em uploads/blobs/<hh>/<sha256>.<ext>:
+        envios repetidos do mesmo arquivo (de qualquer paciente) apontam para o
+        mesmo caminho. A contagem de referências fica em FileBlob; o arquivo só
+        vai para o caminho final em store_file, depois de FileBlob.acquire.
+        """
         if not file or not self.allowed_file(file.filename):
             raise ValueError("Tipo de arquivo não permitido")
 
         filename = secure_filename(file.filename)
         ext = filename.rsplit('.', 1)[1].lower()
 
-        # Cria pasta uploads/<patient_id>
-        patient_folder = os.path.join(self.upload_folder, str(patient_id))
-        if not os.path.exists(patient_folder):
-            os.makedirs(patient_folder)
+        blobs_folder = os.path.join(self.upload_folder, "blobs")
+        os.makedirs(blobs_folder, exist_ok=True)
 
-        # Salva com nome único
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(patient_folder, unique_filename)
-        file.save(file_path)
+        temp_path, file_size, file_hash = self._stream_to_temp(file.stream, blobs_folder)
 
         # Monta metadados
         info = {
             "original_filename": filename,
-            "file_path": file_path,
-            "file_size": os.path.getsize(file_path),
+            "file_path": os.path.join(blobs_folder, file_hash[:2], f"{file_hash}.{ext}"),
+            "file_size": file_size,
+            "file_hash": file_hash,
             "file_type": "pdf" if ext == "pdf" else "image",
-            "mime_type": "application/pdf" if ext == "pdf" else f"image/{ext}"
+            "mime_type": "application/pdf" if ext == "pdf" else f"image/{ext}",
+            "temp_path": temp_path
         }
         return info
 
+    def store_file(self, file_info):
+        """Move o arquivo recebido para o caminho final do blob.
+
+        Chamar depois de FileBlob.acquire, na mesma transação: a linha do blob
+        fica travada até o commit, então uma remoção concorrente do mesmo
+        conteúdo (FileBlob.delete_file_if_unused) não apaga o arquivo gravado aqui.
+        """
+        temp_path = file_info.pop("temp_path", None)
+        if not temp_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(file_info["file_path"]), exist_ok=True)
+            # Mesmo se o blob já existe, a troca atômica mantém o conteúdo idêntico
+            os.replace(temp_path, file_info["file_path"])
+            file_info["stored"] = True  # se a transação for revertida: FileBlob.discard_unreferenced
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def discard_file(self, file_info):
+        """Apaga o arquivo temporário de um upload que não chegou a store_file"""
+        temp_path = file_info.pop("temp_path", None) if file_info else None
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def _stream_to_temp(self, stream, folder):
+        """Grava o stream em blocos num arquivo temporário dentro de ``folder``.
+
+        Calcula o SHA-256 durante a cópia e aborta assim que o tamanho passa do
+        limite; a memória usada é de um bloco, qualquer que seja o arquivo.
+        Retorna (caminho temporário, tamanho, sha256 hex); o chamador renomeia.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".upload-", suffix=".part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as output:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        raise ValueError(
+                            f"Arquivo muito grande. Máximo permitido: {self.max_file_size / (1024 * 1024):.1f}MB"
+                        )
+                    digest.update(chunk)
+                    output.write(chunk)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return temp_path, size, digest.hexdigest()
+
     def extract_text_from_file(self, file_path, file_type):
         """Extrai texto do arquivo (simplificado, sem OCR real para imagens)"""
+        pages, err = self.extract_pages_from_file(file_path, file_type)
+        if err:
+            return None, err
+        return "".join(pages), None
+
+    def extract_pages_from_file(self, file_path, file_type, cancel_event=None):
+        """Extrai o texto por página; retorna (lista de textos, erro).
+
+        ``cancel_event`` interrompe o OCR em andamento (OCRCancelled sobe para o chamador).
+        """
         try:
             if file_type == "pdf":
-                return self._extract_text_from_pdf(file_path)
+                return self._extract_pages_from_pdf(file_path)
             elif file_type == "image":
-                # Sem OCR real no ambiente Render
-                return "Texto extraído da imagem (OCR não disponível em produção)", None
+                return self._extract_pages_from_image(file_path, cancel_event)
             else:
                 return None, "Tipo de arquivo não suportado"
+        except OCRCancelled:
+            raise
         except Exception as e:
             return None, f"Erro ao extrair texto: {str(e)}"
 
-    def _extract_text_from_pdf(self, file_path):
+    def _extract_pages_from_image(self, file_path, cancel_event=None):
+        try:
+            # OCR no pool de processos (tempo e memória limitados)
+            return [ocr_service.recognize_file(file_path, cancel_event=cancel_event)], None
+        except OCRCancelled:
+            raise  # não é falha do arquivo: o job é tentado de novo
+        except OCRUnavailable:
+            # Sem motor de OCR instalado (ex.: Render sem tesseract)
+            return ["Texto extraído da imagem (OCR não disponível em produção)"], None
+        except OCRError as e:
+            return None, f"Erro no OCR da imagem: {str(e)}"
+
+    def _extract_pages_from_pdf(self, file_path):
         try:
-            import PyPDF2
-            text = ""
-            with open(file_path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text += page.extract_text() or ""
-            return text, None
+            # Páginas em paralelo (pool de processos) para PDFs grandes
+            return extract_pdf_pages(file_path), None
         except Exception as e:
             return None, f"Erro ao extrair texto do PDF: {str(e)}"
     
@@ -0,0 +1,185 @@
+import os
+
+import numpy as np
+
+# Pré-processamento das imagens antes do OCR, todo em memória (arrays NumPy)
+OCR_TARGET_DPI = int(os.environ.get('OCR_TARGET_DPI', 300))
+OCR_THRESHOLD_WINDOW = int(os.environ.get('OCR_THRESHOLD_WINDOW', 41))  # lado da janela do limiar local (px)
+OCR_THRESHOLD_OFFSET = int(os.environ.get('OCR_THRESHOLD_OFFSET', 12))  # quanto abaixo da média local é tinta (mínimo)
+OCR_MAX_SKEW_DEGREES = float(os.environ.get('OCR_MAX_SKEW_DEGREES', 5))
+
+A4_WIDTH_INCHES = 8.27  # imagem sem DPI: assume página A4 digitalizada na largura
+MAX_PAGE_WIDTH_INCHES = 2 * A4_WIDTH_INCHES
+MIN_SCALE, MAX_SCALE = 0.25, 4.0
+SKEW_SAMPLE_POINTS = 200000  # pixels de tinta usados na estimativa de inclinação
+DENSE_LINE_FRACTION = 0.6  # linha/coluna com mais tinta que isso é borda ou sombra do scanner
+NOISE_SIGMAS = 3  # o limiar fica abaixo da média ao menos isso x o ruído estimado
+DARK_BORDER_FRACTION = 0.5  # faixa na borda mais escura que isso x o fundo é sombra do scanner
+
+
+def estimate_dpi(image):
+    """DPI declarado no arquivo ou, sem ele, o de uma página A4 com essa largura.
+
+    Muitos scanners e celulares gravam 72 DPI fixo: o valor declarado só vale
+    se a largura da página resultante for plausível.
+    """
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0] and image.width / dpi[0] <= MAX_PAGE_WIDTH_INCHES:
+        return float(dpi[0])
+    return image.width / A4_WIDTH_INCHES
+
+
+def normalize_dpi(image, target_dpi=OCR_TARGET_DPI):
+    """Redimensiona para ``target_dpi`` (o OCR perde precisão com texto pequeno ou enorme)"""
+    scale = min(MAX_SCALE, max(MIN_SCALE, target_dpi / estimate_dpi(image)))
+    if abs(scale - 1) < 0.05:
+        return image
+    from PIL import Image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+def adaptive_threshold(gray, window=OCR_THRESHOLD_WINDOW, offset=OCR_THRESHOLD_OFFSET):
+    """Máscara de tinta: pixel mais escuro que a média da janela ao redor menos ``offset``.
+
+    A média local (imagem integral) tolera iluminação irregular e fundo
+    acinzentado, que um limiar global transforma em manchas. Em digitalizações
+    ruidosas o ``offset`` sobe com o ruído estimado (desvio robusto em torno
+    da média local; o texto é minoria dos pixels).
+    """
+    half = window // 2
+    window = 2 * half + 1
+    area = window * window
+    height, width = gray.shape
+
+    # Imagem integral em uint32 com estouro: as diferenças entre quatro cantos
+    # continuam exatas (a soma de uma janela cabe em 32 bits) e usam metade da memória
+    padded = np.pad(gray, half, mode='edge')
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.uint32)
+    np.cumsum(padded, axis=0, dtype=np.uint32, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+
+    sums = integral[window:, window:] - integral[:height, window:] - integral[window:, :width] + integral[:height, :width]
+    darkness = sums.astype(np.int32) - gray.astype(np.int32) * area  # (média local - pixel) x área
+    noise = 1.4826 * float(np.median(np.abs(darkness[::4, ::4]))) / area
+    return darkness > max(offset, NOISE_SIGMAS * noise) * area
+
+
+def despeckle(ink):
+    """Remove pixels de tinta com menos de dois vizinhos (ruído e artefatos de JPEG)"""
+    padded = np.pad(ink, 1).astype(np.uint8)
+    height, width = ink.shape
+    neighbours = sum(
+        padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx
+    )
+    return ink & (neighbours >= 2)
+
+
+def _projection_scores(ys, xs, angles):
+    """Soma dos quadrados do perfil horizontal da tinta girada por cada ângulo (vetorizado)"""
+    radians = np.deg2rad(angles)[:, None]
+    rows = np.rint(ys * np.cos(radians) + xs * np.sin(radians)).astype(np.int64)
+    rows -= rows.min()
+    bins = int(rows.max()) + 1
+    offsets = np.arange(len(angles), dtype=np.int64)[:, None] * bins
+    profiles = np.bincount((rows + offsets).ravel(), minlength=len(angles) * bins)
+    return (profiles.reshape(len(angles), bins).astype(np.float64) ** 2).sum(axis=1)
+
+
+def estimate_skew(ink, max_degrees=OCR_MAX_SKEW_DEGREES):
+    """Inclinação do texto em graus (anti-horário, como Image.rotate); 0 se não há texto.
+
+    As linhas de texto ficam alinhadas quando o perfil de projeção é mais
+    concentrado: busca grossa de 1 em 1 grau e fina de 0,1 em 0,1.
+    """
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100 or not max_degrees:
+        return 0.0
+    step = max(1, len(ys) // SKEW_SAMPLE_POINTS)
+    ys, xs = ys[::step].astype(np.float64), xs[::step].astype(np.float64)
+
+    coarse = np.arange(-max_degrees, max_degrees + 0.5, 1.0)
+    best = coarse[np.argmax(_projection_scores(ys, xs, coarse))]
+    fine = np.arange(best - 1, best + 1.05, 0.1)
+    return float(round(fine[np.argmax(_projection_scores(ys, xs, fine))], 1))
+
+
+def rotate_mask(ink, degrees):
+    from PIL import Image
+    image = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), 'L')
+    rotated = image.rotate(degrees, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+    return np.asarray(rotated) < 128
+
+
+def _edge_run(flags):
+    """Quantas posições seguidas, a partir do início, são True"""
+    misses = np.flatnonzero(~flags)
+    return int(misses[0]) if len(misses) else len(flags)
+
+
+def clear_borders(ink, gray):
+    """Remove da máscara as faixas escuras nas bordas e as linhas que cruzam a página.
+
+    Sombras do scanner e bordas pretas viram linhas retas na binarização, que
+    dominariam a estimativa de inclinação e o recorte.
+    """
+    ink = ink.copy()
+    height, width = ink.shape
+    dark = DARK_BORDER_FRACTION * np.median(gray[::4, ::4])
+    dark_rows = gray.mean(axis=1) < dark
+    dark_cols = gray.mean(axis=0) < dark
+
+    top, bottom = _edge_run(dark_rows), _edge_run(dark_rows[::-1])
+    left, right = _edge_run(dark_cols), _edge_run(dark_cols[::-1])
+    ink[:top], ink[height - bottom:], ink[:, :left], ink[:, width - right:] = False, False, False, False
+
+    ink[ink.sum(axis=1) > DENSE_LINE_FRACTION * width] = False
+    ink[:, ink.sum(axis=0) > DENSE_LINE_FRACTION * height] = False
+    return ink
+
+
+def _content_span(counts, length, band):
+    """Primeira e última posição com tinta de texto: a contagem somada em faixas de
+    ``band`` pixels separa linhas de texto dos respingos que sobram do despeckle"""
+    smoothed = np.convolve(counts, np.ones(band, dtype=np.int64), mode='same')
+    hits = np.flatnonzero(smoothed > band * max(2, length // 500))
+    return (int(hits[0]), int(hits[-1]) + 1) if len(hits) else None
+
+
+def content_box(ink, margin, band=15):
+    """(top, bottom, left, right) do texto com ``margin`` pixels de folga (sem texto: a imagem toda)"""
+    height, width = ink.shape
+    rows = _content_span(ink.sum(axis=1), width, band)
+    cols = _content_span(ink.sum(axis=0), height, band)
+    if rows is None or cols is None:
+        return 0, height, 0, width
+
+    return (max(0, rows[0] - margin), min(height, rows[1] + margin),
+            max(0, cols[0] - margin), min(width, cols[1] + margin))
+
+
+def preprocess_for_ocr(image, target_dpi=OCR_TARGET_DPI):
+    """Imagem binarizada (tinta preta, fundo branco), sem inclinação e sem bordas, em ``target_dpi``.
+
+    Tudo em memória: nenhum arquivo intermediário é gravado.
+    """
+    from PIL import Image, ImageOps
+    image = normalize_dpi(ImageOps.exif_transpose(image).convert('L'), target_dpi)
+
+    gray = np.asarray(image)
+    ink = clear_borders(despeckle(adaptive_threshold(gray)), gray)
+    skew = estimate_skew(ink)
+    margin, band = target_dpi // 10, max(1, target_dpi // 20)
+    top, bottom, left, right = content_box(ink, margin, band)
+    ink = ink[top:bottom, left:right]
+    if abs(skew) >= 0.1:
+        # Gira só o conteúdo e recorta de novo (a rotação cria cantos vazios)
+        ink = rotate_mask(ink, -skew)
+        top, bottom, left, right = content_box(ink, margin, band)
+        ink = ink[top:bottom, left:right]
+
+    result = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), 'L')
+    result.info['dpi'] = (target_dpi, target_dpi)
+    result.info['skew'] = skew  # inclinação corrigida, em graus
+    return result
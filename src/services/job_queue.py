@@ -0,0 +1,119 @@
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from src.models import db
+from src.models.job import Job
+
+# Handlers registrados por tipo de job: kind -> função(job)
+_handlers = {}
+# Jobs periódicos: kind -> intervalo em segundos
+_periodic = {}
+
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 15 * 60))
+BACKOFF_BASE = float(os.environ.get('JOB_BACKOFF_BASE', 5))
+BACKOFF_MAX = float(os.environ.get('JOB_BACKOFF_MAX', 10 * 60))
+
+
+def register_handler(kind):
+    """Decorador que associa uma função ao tipo de job"""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def register_periodic(kind, interval_seconds):
+    """Agenda ``kind`` para rodar a cada ``interval_seconds`` (os workers enfileiram)"""
+    _periodic[kind] = interval_seconds
+
+
+def backoff_seconds(attempts):
+    """Backoff exponencial com jitter: base * 2^(tentativas-1), limitado"""
+    delay = min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobWorker(threading.Thread):
+    """Thread que consome a fila de jobs enquanto o processo estiver vivo"""
+
+    def __init__(self, app, name):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{name}'
+        self._stop_event = threading.Event()
+        self._cancel_event = None  # do job em execução
+        self._last_stale_check = 0.0
+        self._last_periodic_check = 0.0
+
+    def stop(self):
+        self._stop_event.set()
+        cancel_event = self._cancel_event
+        if cancel_event is not None:
+            cancel_event.set()  # interrompe o OCR do job atual; o job é tentado de novo
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    self._requeue_stale_jobs()
+                    self._schedule_periodic_jobs()
+                    job = Job.claim_next(self.worker_id)
+                    if job is not None:
+                        self._execute(job)
+                        continue
+            except Exception:
+                traceback.print_exc()
+            self._stop_event.wait(POLL_INTERVAL)
+
+    def _requeue_stale_jobs(self):
+        now = time.monotonic()
+        if now - self._last_stale_check >= 60:
+            self._last_stale_check = now
+            Job.requeue_stale(LOCK_TIMEOUT)
+
+    def _schedule_periodic_jobs(self):
+        now = time.monotonic()
+        if _periodic and now - self._last_periodic_check >= 60:
+            self._last_periodic_check = now
+            for kind, interval in _periodic.items():
+                Job.enqueue_periodic(kind, interval)
+
+    def _execute(self, job):
+        job_id = job.id
+        handler = _handlers.get(job.kind)
+        # job.cancel_event: o handler repassa ao OCR. É acionado em stop() e ao
+        # passar de LOCK_TIMEOUT, quando requeue_stale entregaria o job a outro worker
+        job.cancel_event = self._cancel_event = threading.Event()
+        timer = threading.Timer(LOCK_TIMEOUT, job.cancel_event.set)
+        timer.daemon = True
+        timer.start()
+        try:
+            if handler is None:
+                raise ValueError(f'Tipo de job desconhecido: {job.kind}')
+            handler(job)
+            job = db.session.get(Job, job_id)
+            job.mark_completed()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.mark_failed(str(e), backoff_seconds(job.attempts))
+            db.session.commit()
+        finally:
+            timer.cancel()
+            self._cancel_event = None
+
+
+def start_workers(app, count):
+    """Inicia ``count`` threads de worker neste processo e as retorna"""
+    # Garante que os handlers estejam registrados
+    import src.services.exam_processing  # noqa: F401
+
+    workers = [JobWorker(app, f'job-worker-{index}') for index in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
@@ -0,0 +1,349 @@
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# OCR de exames em imagem: motor plugável executado num pool fixo de processos
+OCR_ENGINE = os.environ.get('OCR_ENGINE', 'tesseract')  # 'tesseract' ou 'fake'
+OCR_LANG = os.environ.get('OCR_LANG', 'por')
+# Metade dos núcleos por padrão: o OCR não deve tomar a CPU dos workers web
+OCR_PROCESSES = int(os.environ.get('OCR_PROCESSES', max(1, (os.cpu_count() or 2) // 2)))
+OCR_TIMEOUT = float(os.environ.get('OCR_TIMEOUT', 60))  # segundos por imagem
+OCR_QUEUE_TIMEOUT = float(os.environ.get('OCR_QUEUE_TIMEOUT', 120))  # espera por um processo livre
+OCR_MEMORY_LIMIT_MB = int(os.environ.get('OCR_MEMORY_LIMIT_MB', 1024))  # por processo (0 = sem limite)
+# Binarização, correção de inclinação e recorte antes do OCR (image_preprocessing)
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', 'true').lower() == 'true'
+
+
+class OCRError(Exception):
+    """Falha no reconhecimento de texto"""
+
+
+class OCRTimeout(OCRError):
+    """O OCR passou do tempo limite e o processo foi encerrado"""
+
+
+class OCRCancelled(OCRError):
+    """O OCR foi cancelado pelo chamador e o processo foi encerrado"""
+
+
+class OCRUnavailable(OCRError):
+    """O motor configurado não está instalado neste ambiente"""
+
+
+# --- Motores ---
+class OCREngine:
+    """Interface dos motores de OCR: recebem uma imagem PIL e devolvem o texto"""
+    name = None
+
+    def is_available(self):
+        return True
+
+    def recognize(self, image):
+        raise NotImplementedError
+
+
+class TesseractEngine(OCREngine):
+    """OCR com Tesseract (pytesseract + binário tesseract no PATH)"""
+    name = 'tesseract'
+
+    def __init__(self, lang=OCR_LANG):
+        self.lang = lang
+
+    def is_available(self):
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            return True
+        except Exception:
+            return False
+
+    def recognize(self, image):
+        import pytesseract
+        return pytesseract.image_to_string(image, lang=self.lang).strip()
+
+
+class FakeEngine(OCREngine):
+    """Motor de testes: devolve texto fixo (OCR_FAKE_TEXT) após OCR_FAKE_DELAY segundos"""
+    name = 'fake'
+
+    def __init__(self, text=None, delay=None):
+        self.text = text if text is not None else os.environ.get('OCR_FAKE_TEXT', 'Texto reconhecido (OCR fake)')
+        self.delay = delay if delay is not None else float(os.environ.get('OCR_FAKE_DELAY', 0))
+
+    def recognize(self, image):
+        if self.delay:
+            time.sleep(self.delay)
+        return f'{self.text} [{image.width}x{image.height}]'
+
+
+ENGINES = {
+    TesseractEngine.name: TesseractEngine,
+    FakeEngine.name: FakeEngine
+}
+
+
+def register_engine(engine_class):
+    """Disponibiliza um motor para OCR_ENGINE (o módulo precisa ser importável nos processos do pool)"""
+    ENGINES[engine_class.name] = engine_class
+    return engine_class
+
+
+def create_engine(name):
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise OCRError(f'Motor de OCR desconhecido: {name}')
+
+
+# --- Processos do pool ---
+def _apply_memory_limit(limit_mb):
+    if not limit_mb:
+        return
+    try:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass  # plataforma sem RLIMIT_AS (ex.: Windows): segue sem limite
+
+
+def _payload_to_image(payload):
+    """Imagem a partir do payload: arquivo codificado ('encoded') ou pixels crus ('raw', 'mode', 'size')"""
+    from PIL import Image
+    if 'raw' in payload:
+        image = Image.frombuffer(payload['mode'], payload['size'], payload['raw'], 'raw', payload['mode'], 0, 1)
+        if payload.get('dpi'):
+            image.info['dpi'] = payload['dpi']
+        return image
+    image = Image.open(io.BytesIO(payload['encoded']))
+    image.load()
+    return image
+
+
+def _worker_main(connection, engine_name, memory_limit_mb, preprocess):
+    """Laço de um processo do pool: recebe imagens pelo pipe e devolve o texto"""
+    _apply_memory_limit(memory_limit_mb)
+    engine = create_engine(engine_name)
+    if preprocess:
+        from src.services.image_preprocessing import preprocess_for_ocr
+    else:
+        preprocess_for_ocr = None
+    while True:
+        try:
+            payload = connection.recv()
+        except (EOFError, OSError):
+            break
+        if payload is None:
+            break
+        try:
+            image = _payload_to_image(payload)
+            if preprocess_for_ocr is not None:
+                image = preprocess_for_ocr(image)  # em memória, sem arquivos temporários
+            connection.send(('ok', engine.recognize(image)))
+        except MemoryError:
+            connection.send(('error', f'Memória insuficiente para o OCR (limite de {memory_limit_mb}MB)'))
+        except Exception as e:
+            connection.send(('error', str(e)))
+
+
+class _OCRProcess:
+    """Um processo do pool com o pipe de comunicação"""
+
+    def __init__(self, context, engine_name, memory_limit_mb, preprocess):
+        if preprocess:
+            # O pré-processamento não usa BLAS: uma thread evita buffers por núcleo sob RLIMIT_AS.
+            # Definido antes de start(): o filho (spawn) importa módulos antes de _worker_main,
+            # e o OpenBLAS lê a variável ao carregar.
+            os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_connection, engine_name, memory_limit_mb, preprocess), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def run(self, payload, timeout, cancel_event=None):
+        self.connection.send(payload)
+        deadline = time.monotonic() + timeout
+        while not self.connection.poll(0.05):
+            if cancel_event is not None and cancel_event.is_set():
+                self.kill()
+                raise OCRCancelled('OCR cancelado')
+            if time.monotonic() >= deadline:
+                self.kill()
+                raise OCRTimeout(f'OCR excedeu {timeout:.0f}s')
+            if not self.process.is_alive():
+                self.kill()  # já morto: só libera o pipe
+                raise OCRError('Processo de OCR encerrado inesperadamente (memória?)')
+        try:
+            status, result = self.connection.recv()
+        except (EOFError, OSError):
+            self.kill()  # morreu depois de fechar o pipe
+            raise OCRError('Processo de OCR encerrado inesperadamente (memória?)')
+        if status != 'ok':
+            raise OCRError(result)
+        return result
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.connection.close()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+# --- Métricas ---
+class OCRStats:
+    """Contadores e latências recentes do OCR neste processo"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)   # segundos das últimas imagens concluídas
+        self._finished_at = deque(maxlen=window)  # instantes de conclusão (vazão)
+        self.counts = {'completed': 0, 'failed': 0, 'timeouts': 0, 'cancelled': 0}
+
+    def record(self, outcome, latency=None):
+        with self._lock:
+            self.counts[outcome] += 1
+            if outcome == 'completed':
+                self._latencies.append(latency)
+                self._finished_at.append(time.monotonic())
+
+    @staticmethod
+    def _percentile(ordered, fraction):
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return round(ordered[index] * 1000, 1)
+
+    def snapshot(self):
+        with self._lock:
+            ordered = sorted(self._latencies)
+            now = time.monotonic()
+            last_minute = sum(1 for finished in self._finished_at if now - finished <= 60)
+            return {
+                **self.counts,
+                'latency_ms': {
+                    'p50': self._percentile(ordered, 0.50),
+                    'p95': self._percentile(ordered, 0.95),
+                    'p99': self._percentile(ordered, 0.99),
+                    'samples': len(ordered)
+                },
+                'throughput_per_minute': last_minute
+            }
+
+
+# --- Serviço ---
+class OCRService:
+    """Pool fixo de processos de OCR com tempo limite, cancelamento e limite de memória.
+
+    Cada imagem ocupa um processo; se não há processo livre em ``queue_timeout``
+    segundos, a chamada falha. Processos que estouram o tempo ou são cancelados
+    são encerrados e recriados no próximo uso.
+    """
+
+    def __init__(self, engine_name=OCR_ENGINE, processes=OCR_PROCESSES, timeout=OCR_TIMEOUT,
+                 queue_timeout=OCR_QUEUE_TIMEOUT, memory_limit_mb=OCR_MEMORY_LIMIT_MB, preprocess=OCR_PREPROCESS):
+        self.engine_name = engine_name
+        self.processes = processes
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.preprocess = preprocess
+        self.stats = OCRStats()
+        self._context = multiprocessing.get_context('spawn')  # processo web tem threads
+        self._idle = queue.Queue()
+        for _ in range(processes):
+            self._idle.put(None)  # vaga sem processo: criado no primeiro uso
+        self._available = None
+
+    def is_available(self):
+        if self._available is None:
+            self._available = create_engine(self.engine_name).is_available()
+        return self._available
+
+    def recognize_bytes(self, data, timeout=None, cancel_event=None):
+        """Texto reconhecido numa imagem codificada (PNG/JPEG...)"""
+        return self._run({'encoded': data}, timeout, cancel_event)
+
+    def recognize_image(self, image, timeout=None, cancel_event=None):
+        """Texto reconhecido numa imagem PIL já aberta (os pixels vão crus pelo pipe)"""
+        return self._run({
+            'raw': image.tobytes(), 'mode': image.mode, 'size': image.size, 'dpi': image.info.get('dpi')
+        }, timeout, cancel_event)
+
+    def recognize_file(self, file_path, timeout=None, cancel_event=None):
+        with open(file_path, 'rb') as f:
+            return self.recognize_bytes(f.read(), timeout, cancel_event)
+
+    def _run(self, payload, timeout, cancel_event):
+        if not self.is_available():
+            raise OCRUnavailable(f'Motor de OCR "{self.engine_name}" não disponível neste ambiente')
+
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise OCRError('Todos os processos de OCR estão ocupados')
+
+        started = time.monotonic()
+        try:
+            if worker is not None and not worker.is_alive():
+                worker.kill()
+                worker = None
+            if worker is None:
+                worker = _OCRProcess(self._context, self.engine_name, self.memory_limit_mb, self.preprocess)
+            text = worker.run(payload, timeout or self.timeout, cancel_event)
+            self.stats.record('completed', time.monotonic() - started)
+            return text
+        except OCRTimeout:
+            worker = None
+            self.stats.record('timeouts')
+            raise
+        except OCRCancelled:
+            worker = None
+            self.stats.record('cancelled')
+            raise
+        except Exception:
+            self.stats.record('failed')
+            raise
+        finally:
+            if worker is not None and not worker.is_alive():
+                worker.kill()  # processo morto não volta para o pool: a vaga é recriada no próximo uso
+                worker = None
+            self._idle.put(worker)
+
+    def get_stats(self):
+        return {
+            'engine': self.engine_name,
+            'available': self.is_available(),
+            'processes': self.processes,
+            'preprocess': self.preprocess,
+            'timeout_seconds': self.timeout,
+            **self.stats.snapshot()
+        }
+
+    def shutdown(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+
+
+ocr_service = OCRService()
@@ -0,0 +1,133 @@
+import bisect
+import threading
+import time
+from src.models import db
+from src.models.patient import Patient, fold_text
+
+
+class PatientNameIndex:
+    """Índice em memória de prefixos de nomes (sem acentos) dos pacientes ativos.
+
+    Cada palavra do nome vira uma entrada ``(palavra, nome_normalizado, id)``
+    numa lista ordenada; a busca é um ``bisect`` até o prefixo seguido de uma
+    varredura curta, sem tocar no banco. O índice é montado no primeiro uso e
+    atualizado pelas rotas de paciente a cada cadastro/alteração. Como cada
+    processo do gunicorn tem o seu, a cada ``refresh_interval`` segundos uma
+    consulta barata (COUNT/MAX(updated_at)) detecta mudanças feitas por outros
+    processos e reconstrói o índice. As gravações deste processo já entram na
+    versão esperada, então não causam reconstrução.
+    """
+
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._entries = []  # [(palavra, nome_normalizado, id)] ordenada
+        self._patients = {}  # id -> (full_name, [entradas])
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0.0
+
+    @staticmethod
+    def _make_entries(patient_id, full_name):
+        folded = fold_text(full_name)
+        return [(token, folded, patient_id) for token in sorted(set(folded.split()))]
+
+    @staticmethod
+    def _db_version():
+        return db.session.query(db.func.count(Patient.id), db.func.max(Patient.updated_at)).one()
+
+    def _build(self):
+        rows = db.session.query(Patient.id, Patient.full_name).filter(Patient.active == True).all()
+        entries = []
+        patients = {}
+        for patient_id, full_name in rows:
+            patient_entries = self._make_entries(patient_id, full_name)
+            entries.extend(patient_entries)
+            patients[patient_id] = (full_name, patient_entries)
+        entries.sort()
+
+        self._entries = entries
+        self._patients = patients
+        self._loaded = True
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.refresh_interval:
+            return
+
+        version = tuple(self._db_version())
+        if not self._loaded or version != self._version:
+            self._build()
+        self._version = version
+        self._checked_at = now
+
+    def _record_write(self, updated_at, created=False):
+        """Inclui uma gravação deste processo na versão conhecida (COUNT, MAX(updated_at))"""
+        if self._version is None:
+            return
+        count, max_updated_at = self._version
+        if updated_at is not None and (max_updated_at is None or updated_at > max_updated_at):
+            max_updated_at = updated_at
+        self._version = (count + (1 if created else 0), max_updated_at)
+
+    def _remove_locked(self, patient_id):
+        _, entries = self._patients.pop(patient_id, (None, []))
+        for entry in entries:
+            position = bisect.bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+    def sync(self, patient, created=False):
+        """Atualiza o índice após cadastro (``created``)/alteração/ativação de um paciente"""
+        with self._lock:
+            if not self._loaded:
+                return  # será incluído quando o índice for montado
+            self._record_write(patient.updated_at, created)
+            self._remove_locked(patient.id)
+            if patient.active:
+                entries = self._make_entries(patient.id, patient.full_name)
+                for entry in entries:
+                    bisect.insort(self._entries, entry)
+                self._patients[patient.id] = (patient.full_name, entries)
+
+    def remove(self, patient_id, updated_at=None):
+        """Remove um paciente do índice (desativação)"""
+        with self._lock:
+            if self._loaded:
+                self._record_write(updated_at)
+                self._remove_locked(patient_id)
+
+    def search(self, query, limit=10):
+        """Retorna até ``limit`` pacientes cujas palavras começam com os termos da busca"""
+        terms = fold_text(query).split()
+        if not terms:
+            return []
+
+        with self._lock:
+            self._ensure_fresh()
+
+            # Busca pelo termo mais longo (mais seletivo); os demais filtram
+            anchor = max(terms, key=len)
+            others = list(terms)
+            others.remove(anchor)
+
+            results = []
+            seen = set()
+            position = bisect.bisect_left(self._entries, (anchor,))
+            while position < len(self._entries) and len(results) < limit:
+                token, folded, patient_id = self._entries[position]
+                if not token.startswith(anchor):
+                    break
+                position += 1
+
+                if patient_id in seen:
+                    continue
+                name_tokens = folded.split()
+                if all(any(t.startswith(term) for t in name_tokens) for term in others):
+                    seen.add(patient_id)
+                    results.append({'id': patient_id, 'full_name': self._patients[patient_id][0]})
+
+            return results
+
+
+patient_name_index = PatientNameIndex()
@@ -0,0 +1,132 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Limite de páginas extraídas por PDF (0 = sem limite)
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 500))
+# Abaixo disso a extração é sequencial: abrir o pool custa mais que o ganho
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 16))
+# Páginas por tarefa enviada ao pool
+PDF_PAGES_PER_CHUNK = int(os.environ.get('PDF_PAGES_PER_CHUNK', 8))
+# Processos do pool (0 desativa a extração paralela)
+PDF_EXTRACTION_PROCESSES = int(os.environ.get('PDF_EXTRACTION_PROCESSES', os.cpu_count() or 1))
+# Prazo (s) para o pool extrair todas as faixas de um PDF
+PDF_EXTRACTION_TIMEOUT = float(os.environ.get('PDF_EXTRACTION_TIMEOUT', 120))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Último PDF aberto neste processo do pool: faixas do mesmo arquivo não o
+# reabrem (o parse da estrutura do PDF é a parte cara de abrir o leitor)
+_reader_cache = {}
+
+
+class PDFExtractionTimeout(Exception):
+    """A extração no pool passou de PDF_EXTRACTION_TIMEOUT segundos"""
+
+
+def _open_reader(file_path):
+    import PyPDF2
+    key = (file_path, os.path.getmtime(file_path))
+    reader = _reader_cache.get(key)
+    if reader is None:
+        _reader_cache.clear()
+        reader = PyPDF2.PdfReader(file_path)
+        _reader_cache[key] = reader
+    return reader
+
+
+def _extract_page_range(file_path, start, end):
+    """Texto de cada página de [start, end) — executado nos processos do pool"""
+    reader = _open_reader(file_path)
+    return [reader.pages[index].extract_text() or '' for index in range(start, end)]
+
+
+def _get_pool():
+    """Pool de processos compartilhado, criado no primeiro uso.
+
+    Usa 'spawn': o processo web tem threads (workers de jobs, servidor) e
+    um fork herdaria locks em estado inconsistente.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+def _reset_pool(terminate=False):
+    """Descarta o pool; com ``terminate`` encerra também os processos ainda ocupados"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            # shutdown não interrompe tarefas em andamento: um processo travado
+            # num PDF seguiria ocupando CPU e memória
+            processes = list((_pool._processes or {}).values()) if terminate else []
+            _pool.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                process.terminate()
+            _pool = None
+
+
+atexit.register(_reset_pool)
+
+
+def page_ranges(page_count, chunk_size):
+    """Divide [0, page_count) em faixas consecutivas de até chunk_size páginas"""
+    return [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+
+
+def extract_pdf_pages(file_path, max_pages=None, parallel=None, timeout=None):
+    """Extrai o texto de cada página do PDF, na ordem, até ``max_pages`` páginas.
+
+    PDFs grandes são divididos em faixas de páginas extraídas em paralelo no
+    pool de processos. Se um processo do pool morrer, a extração segue
+    sequencialmente neste processo; se o pool passar de ``timeout`` segundos,
+    ele é recriado e PDFExtractionTimeout é levantada (repetir a extração
+    aqui travaria o worker no mesmo PDF).
+    """
+    if max_pages is None:
+        max_pages = PDF_MAX_PAGES
+    if timeout is None:
+        timeout = PDF_EXTRACTION_TIMEOUT or None
+
+    import PyPDF2
+    reader = PyPDF2.PdfReader(file_path)
+    page_count = len(reader.pages)
+    if max_pages:
+        page_count = min(page_count, max_pages)
+
+    if parallel is None:
+        parallel = PDF_EXTRACTION_PROCESSES > 0 and page_count >= PDF_PARALLEL_MIN_PAGES
+
+    if parallel:
+        ranges = page_ranges(page_count, PDF_PAGES_PER_CHUNK)
+        try:
+            pool = _get_pool()
+            chunks = pool.map(
+                _extract_page_range,
+                [file_path] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges],
+                timeout=timeout
+            )
+            return [page_text for chunk in chunks for page_text in chunk]
+        except TimeoutError:
+            _reset_pool(terminate=True)  # recriado na próxima chamada
+            raise PDFExtractionTimeout(f'extração do PDF passou de {timeout:g}s')
+        except BrokenProcessPool:
+            _reset_pool(terminate=True)
+
+    return [reader.pages[index].extract_text() or '' for index in range(page_count)]
+
+
+def extract_pdf_text(file_path, max_pages=None, parallel=None, timeout=None):
+    """Texto do PDF inteiro: as páginas unidas com ''.join na ordem original"""
+    return ''.join(extract_pdf_pages(file_path, max_pages, parallel, timeout))
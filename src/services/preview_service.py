@@ -0,0 +1,178 @@
+import io
+import os
+import tempfile
+import threading
+
+# Miniaturas dos exames, geradas no processamento e guardadas por hash do arquivo
+PREVIEW_CACHE_DIR = os.environ.get('PREVIEW_CACHE_DIR', os.path.join('uploads', 'previews'))
+PREVIEW_SIZE = int(os.environ.get('PREVIEW_SIZE', 200))  # lado máximo em pixels
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+
+
+class PreviewService:
+    """Gera e guarda miniaturas (primeira página do PDF ou a imagem) num cache em disco.
+
+    Os arquivos ficam em <cache>/<hh>/<sha256>-<tamanho>.<ext>. O cache tem
+    tamanho máximo: quando passa do limite, as miniaturas usadas há mais tempo
+    (mtime, atualizado a cada acesso) são removidas. Arquivos que não puderam
+    ser renderizados ganham um marcador vazio (<sha256>-<tamanho>.none) para
+    não serem tentados de novo a cada pedido.
+    """
+
+    def __init__(self, cache_dir=PREVIEW_CACHE_DIR, size=PREVIEW_SIZE, max_bytes=PREVIEW_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_bytes = max_bytes
+        self.format, self.extension, self.mimetype = self._output_format()
+        self._lock = threading.Lock()
+        self._cache_bytes = None  # estimativa do tamanho do cache (calculada na 1ª limpeza)
+
+    @staticmethod
+    def _output_format():
+        from PIL import features
+        if features.check('webp'):
+            return 'WEBP', 'webp', 'image/webp'
+        return 'JPEG', 'jpg', 'image/jpeg'
+
+    def preview_path(self, file_hash):
+        return os.path.join(self.cache_dir, file_hash[:2], f'{file_hash}-{self.size}.{self.extension}')
+
+    def failure_path(self, file_hash):
+        return os.path.join(self.cache_dir, file_hash[:2], f'{file_hash}-{self.size}.none')
+
+    def is_unavailable(self, file_hash):
+        """True se a miniatura já falhou para este conteúdo (marcador de falha)"""
+        return bool(file_hash) and os.path.exists(self.failure_path(file_hash))
+
+    def get(self, file_hash):
+        """Caminho da miniatura em cache (marcando o uso), ou None"""
+        if not file_hash:
+            return None
+        path = self.preview_path(file_hash)
+        try:
+            os.utime(path)  # ordem de uso para a limpeza LRU
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_create(self, file_path, file_type, file_hash):
+        if self.is_unavailable(file_hash):
+            return None
+        return self.get(file_hash) or self.generate(file_path, file_type, file_hash)
+
+    def generate(self, file_path, file_type, file_hash):
+        """Gera a miniatura do arquivo; retorna o caminho ou None se não há como renderizar.
+
+        Falhas de renderização ficam marcadas; arquivo ausente não (pode voltar ao disco).
+        """
+        if not file_hash or not file_path or not os.path.exists(file_path):
+            return None
+
+        try:
+            image = self._load_image(file_path, file_type)
+            if image is None:
+                self._mark_unavailable(file_hash)
+                return None
+
+            from PIL import ImageOps
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.thumbnail((self.size, self.size))
+        except Exception:
+            self._mark_unavailable(file_hash)  # arquivo corrompido ou formato que o Pillow não lê
+            return None
+
+        path = self.preview_path(file_hash)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.preview-', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                image.save(output, self.format, quality=80)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._account(os.path.getsize(path))
+        return path
+
+    def _mark_unavailable(self, file_hash):
+        path = self.failure_path(file_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+
+    def _load_image(self, file_path, file_type):
+        from PIL import Image
+        if file_type == 'image':
+            image = Image.open(file_path)
+            image.load()
+            return image
+        if file_type == 'pdf':
+            return self._render_pdf_first_page(file_path)
+        return None
+
+    @staticmethod
+    def _render_pdf_first_page(file_path):
+        """Rasteriza a 1ª página com PyMuPDF, se instalado; senão usa a maior
+        imagem embutida na página (PDFs escaneados). Sem nenhum dos dois, None."""
+        from PIL import Image
+        try:
+            import fitz  # PyMuPDF (opcional)
+        except ImportError:
+            fitz = None
+
+        if fitz is not None:
+            with fitz.open(file_path) as document:
+                if document.page_count == 0:
+                    return None
+                pixmap = document[0].get_pixmap(dpi=72)
+                return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+        import PyPDF2
+        reader = PyPDF2.PdfReader(file_path)
+        if not reader.pages:
+            return None
+        images = list(reader.pages[0].images)
+        if not images:
+            return None
+        largest = max(images, key=lambda embedded: len(embedded.data))
+        image = Image.open(io.BytesIO(largest.data))
+        image.load()
+        return image
+
+    # --- Limpeza LRU ---
+    def _account(self, added_bytes):
+        with self._lock:
+            if self._cache_bytes is None or self._cache_bytes + added_bytes > self.max_bytes:
+                self._cache_bytes = self.cleanup()
+            else:
+                self._cache_bytes += added_bytes
+
+    def cleanup(self):
+        """Remove as miniaturas menos usadas até o cache caber no limite; retorna o tamanho final"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        return total
+
+
+preview_service = PreviewService()
@@ -0,0 +1,32 @@
+import os
+import sys
+import signal
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+# Processo dedicado aos jobs: o app web (src.main) não deve iniciar threads
+# próprias quando importado por aqui.
+os.environ['JOB_WORKER_MODE'] = 'external'
+
+from src.main import app
+from src.services.job_queue import start_workers
+
+
+def main():
+    count = int(os.environ.get('JOB_WORKER_THREADS', 2))
+    workers = start_workers(app, count)
+    print(f'{count} worker(s) de jobs iniciados (pid {os.getpid()})')
+
+    def shutdown(signum, frame):
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(timeout=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Banco SQLite e uploads/ numa pasta temporária, definidos antes de importar o app
+_folder = tempfile.mkdtemp(prefix='prontuario-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_folder, "app.db")}'
+os.environ['JOB_WORKER_MODE'] = 'external'
+os.chdir(_folder)  # FileService grava em uploads/ relativo ao diretório atual
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import app as flask_app  # noqa: E402
+from src.models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def patient_id(client):
+    """Paciente novo para o teste (CPFs válidos diferentes a cada chamada)"""
+    import random
+    digits = [random.randint(0, 9) for _ in range(9)]
+    for length in (9, 10):
+        total = sum(digit * weight for digit, weight in zip(digits, range(length + 1, 1, -1)))
+        digits.append(total * 10 % 11 % 10)
+    response = client.post('/api/patients', json={
+        'full_name': 'Paciente Teste', 'cpf': ''.join(map(str, digits)),
+        'birth_date': '1980-05-17', 'gender': 'F'
+    })
+    assert response.status_code == 201, response.json
+    return response.json['patient']['id']
@@ -0,0 +1,59 @@
+import io
+
+from PIL import Image
+
+from src.models.job import Job
+from src.services.exam_processing import generate_exam_preview, process_exam
+from src.services.preview_service import preview_service
+
+
+def _upload(client, patient_id, data, filename):
+    response = client.post(f'/api/patients/{patient_id}/exams', data={
+        'file': (io.BytesIO(data), filename),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 202
+    return response.json['exam']['id']
+
+
+def _png(color):
+    output = io.BytesIO()
+    Image.new('RGB', (640, 480), color).save(output, 'PNG')
+    return output.getvalue()
+
+
+def test_thumbnail_is_served_only_from_cache(client, patient_id):
+    exam_id = _upload(client, patient_id, _png((10, 120, 200)), 'exame.png')
+
+    # Ainda não processado: o job de processamento gera a miniatura
+    assert client.get(f'/api/exams/{exam_id}/thumbnail').status_code == 202
+    assert Job.pending('generate_preview', exam_id=exam_id) is None
+
+    process_exam(Job.pending('process_exam', exam_id=exam_id))
+    response = client.get(f'/api/exams/{exam_id}/thumbnail')
+    assert response.status_code == 200
+    assert max(Image.open(io.BytesIO(response.data)).size) == preview_service.size
+
+
+def test_thumbnail_missing_from_cache_is_generated_by_a_job(client, patient_id, monkeypatch):
+    exam_id = _upload(client, patient_id, _png((200, 30, 30)), 'exame.png')
+    process_exam(Job.pending('process_exam', exam_id=exam_id))
+    monkeypatch.setattr(preview_service, 'get', lambda file_hash: None)  # saiu do cache
+
+    first = client.get(f'/api/exams/{exam_id}/thumbnail')
+    second = client.get(f'/api/exams/{exam_id}/thumbnail')
+    assert first.status_code == second.status_code == 202
+    assert first.json['job']['id'] == second.json['job']['id']
+    assert first.json['job']['kind'] == 'generate_preview'
+
+
+def test_thumbnail_failure_is_remembered(client, patient_id, monkeypatch):
+    exam_id = _upload(client, patient_id, b'\x89PNG\r\n\x1a\n corrompido', 'exame.png')
+    process_exam(Job.pending('process_exam', exam_id=exam_id))
+
+    assert client.get(f'/api/exams/{exam_id}/thumbnail').status_code == 404
+
+    def render(*args):
+        raise AssertionError('miniatura renderizada de novo')
+    monkeypatch.setattr(preview_service, '_load_image', render)
+    generate_exam_preview(Job.enqueue('generate_preview', exam_id=exam_id))
+    assert client.get(f'/api/exams/{exam_id}/thumbnail').status_code == 404
@@ -0,0 +1,83 @@
+import io
+import os
+
+import pytest
+
+from src.models import db
+from src.models.exam import Exam
+from src.models.file_blob import FileBlob
+from src.models.job import Job
+
+
+def _blob_files():
+    """Arquivos em uploads/blobs (inclui temporários de upload)"""
+    return sorted(
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(os.path.join('uploads', 'blobs'))
+        for name in names
+    )
+
+
+def _image(content):
+    return (io.BytesIO(b'\x89PNG\r\n\x1a\n' + content), 'exame.png')
+
+
+@pytest.fixture
+def failing_enqueue(monkeypatch):
+    """Job.enqueue falha a partir da chamada ``fail_from`` (1 = primeira)"""
+    def install(fail_from=1):
+        original = Job.enqueue
+        calls = []
+
+        def enqueue(*args, **kwargs):
+            calls.append(1)
+            if len(calls) >= fail_from:
+                raise RuntimeError('fila indisponível')
+            return original(*args, **kwargs)
+        monkeypatch.setattr(Job, 'enqueue', staticmethod(enqueue))
+    return install
+
+
+def test_failed_upload_leaves_no_blob(client, patient_id, failing_enqueue):
+    before = _blob_files()
+    failing_enqueue()
+
+    response = client.post(f'/api/patients/{patient_id}/exams', data={
+        'file': _image(b'upload que falha'),
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 500
+    assert _blob_files() == before
+    assert Exam.query.filter_by(patient_id=patient_id).count() == 0
+
+
+def test_failed_upload_keeps_blob_of_other_exam(client, patient_id, failing_enqueue):
+    content = b'arquivo compartilhado'
+    response = client.post(f'/api/patients/{patient_id}/exams', data={
+        'file': _image(content),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 202
+    file_path = db.session.get(Exam, response.json["exam"]["id"]).file_path
+
+    failing_enqueue()
+    response = client.post(f'/api/patients/{patient_id}/exams', data={
+        'file': _image(content),
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 500
+    assert os.path.exists(file_path)
+    assert FileBlob.query.filter_by(file_path=file_path).one().ref_count == 1
+
+
+def test_failed_batch_leaves_no_blob(client, patient_id, failing_enqueue):
+    before = _blob_files()
+    failing_enqueue(fail_from=2)
+
+    response = client.post(f'/api/patients/{patient_id}/exams/batch', data={
+        'files': [_image(b'lote 1'), _image(b'lote 2'), _image(b'lote 3')],
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 500
+    assert _blob_files() == before
+    assert Exam.query.filter_by(patient_id=patient_id).count() == 0
+    assert FileBlob.query.filter(FileBlob.file_path.notin_(before)).count() == 0
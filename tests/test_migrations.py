@@ -0,0 +1,40 @@
+from sqlalchemy import text
+
+from src.models import db
+from src.models.compressed_text import is_compressed
+from src.models.exam_page import ExamPage
+from src.models.migrations import run_migrations
+
+
+def _legacy_exam(connection, extracted_text):
+    """Exame gravado antes de exam_pages: texto só em exams.extracted_text"""
+    return connection.execute(text(
+        "INSERT INTO exams (patient_id, original_filename, file_path, processing_status, "
+        "has_results, file_available, extracted_text) "
+        "VALUES (1, 'antigo.pdf', 'uploads/antigo.pdf', 'completed', :no, :yes, :text)"
+    ), {'no': False, 'yes': True, 'text': extracted_text}).lastrowid
+
+
+def test_upgrade_copies_legacy_text_compressed_into_existing_exam_pages(app):
+    # Banco anterior à remoção de exams.extracted_text, com exam_pages já em CompressedText
+    legacy_text = 'Glicose 92 mg/dL \\ ref. C:\\laudos\\x ' * 40  # barras invertidas: inválidas como bytea
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE exams ADD COLUMN extracted_text TEXT'))
+        exam_id = _legacy_exam(connection, legacy_text)
+        connection.execute(text(
+            "DELETE FROM schema_migrations WHERE name IN "
+            "('exam_pages_from_extracted_text', 'exams_drop_extracted_text')"
+        ))
+
+    run_migrations()
+
+    with db.engine.connect() as connection:
+        raw = connection.execute(
+            text('SELECT text FROM exam_pages WHERE exam_id = :id'), {'id': exam_id}
+        ).scalar_one()
+        columns = [row[1] for row in connection.execute(text('PRAGMA table_info(exams)'))]
+    assert is_compressed(raw)
+    assert 'extracted_text' not in columns
+
+    page = ExamPage.query.filter_by(exam_id=exam_id).one()
+    assert (page.page_no, page.text, page.char_count) == (1, legacy_text, len(legacy_text))
@@ -0,0 +1,14 @@
+from src.models.patient import Patient, db
+
+
+def test_search_by_cpf_prefix(client, patient_id):
+    cpf = db.session.get(Patient, patient_id).cpf_digits
+    response = client.get('/api/patients', query_string={'search': f'{cpf[:3]}.{cpf[3:6]}'})
+    assert patient_id in [patient['id'] for patient in response.json['patients']]
+
+
+def test_search_without_digits_is_not_a_cpf_prefix(client, patient_id):
+    for search in ('-', '...', '. -'):
+        response = client.get('/api/patients', query_string={'search': search})
+        assert response.status_code == 200
+        assert response.json['patients'] == []